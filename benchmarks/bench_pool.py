@@ -0,0 +1,94 @@
+"""
+Benchmark the connections made by repeated clones over HTTP.
+
+A local smart HTTP git server serves a repository of the given number
+of files, which is then cloned repeatedly by AuthenticatedDulwichDvcsCmd
+using a single long-lived pool, and once more with a new pool for every
+clone as was done previously.
+
+Usage::
+
+    python benchmarks/bench_pool.py [--clones 10] [--files 10]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from dulwich import porcelain
+
+from pmr2.wfctrl.cmd import AuthenticatedDulwichDvcsCmd
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.testing.gitserver import GitHttpServer
+
+authorization = 'Basic username:password'
+
+
+def make_remote(root, files):
+    remote = os.path.join(root, 'remote')
+    os.makedirs(remote)
+    porcelain.init(remote)
+    paths = []
+    for i in range(files):
+        filename = os.path.join(remote, 'file%06d' % i)
+        with open(filename, 'w') as fd:
+            fd.write('content %d\n' % i)
+        paths.append(filename)
+    porcelain.add(remote, paths)
+    porcelain.commit(remote, message=b'benchmark',
+                     author=b'Bench <bench@example.com>',
+                     committer=b'Bench <bench@example.com>')
+
+
+def bench_clone(root, clones, per_operation=False):
+    with GitHttpServer(root, authorization=authorization) as server:
+        cmd = AuthenticatedDulwichDvcsCmd(remote=server.url_for('remote'))
+        cmd.set_authorization(authorization)
+        target = tempfile.mkdtemp()
+        try:
+            # an untimed clone, such that the first run measured does
+            # not also pay for the imports and the warming of the caches.
+            cmd.clone(CmdWorkspace(os.path.join(target, 'warmup')))
+            cmd.close()
+            connections, requests = server.connections, server.requests
+            start = time.perf_counter()
+            for i in range(clones):
+                if per_operation:
+                    # restore the behavior prior to the pool reuse.
+                    cmd.close()
+                cmd.clone(CmdWorkspace(os.path.join(target, str(i))))
+            elapsed = time.perf_counter() - start
+        finally:
+            cmd.close()
+            shutil.rmtree(target, ignore_errors=True)
+        return (elapsed, server.connections - connections,
+                server.requests - requests)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clones', type=int, default=10)
+    parser.add_argument('--files', type=int, default=10)
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    root = tempfile.mkdtemp()
+    try:
+        make_remote(root, options.files)
+        print('%-14s %8s %12s %9s' % (
+            'pool', 'time', 'connections', 'requests'))
+        for label, per_operation in (
+                ('long-lived', False), ('per-operation', True)):
+            elapsed, connections, requests = bench_clone(
+                root, options.clones, per_operation=per_operation)
+            print('%-14s %7.3fs %12d %9d' % (
+                label, elapsed, connections, requests))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
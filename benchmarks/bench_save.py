@@ -0,0 +1,81 @@
+"""
+Benchmark the time taken by save against the number of tracked files.
+
+For every available backend, a fresh workspace is populated with the
+given number of files and saved once using the batched add_paths, and
+once more adding the files one at a time as was done previously.
+
+Usage::
+
+    python benchmarks/bench_save.py [--counts 10 100 1000] [--backends git]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# importing the cmd module registers the backends.
+import pmr2.wfctrl.cmd
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.core import get_cmd_by_name
+from pmr2.wfctrl.core import merge_results
+
+backend_names = ['git', 'mercurial', 'dulwich']
+
+
+def per_file_add_paths(cmd):
+    # restore the behavior prior to batched adds, one call per path.
+    add_paths = cmd.add_paths
+
+    def per_file(workspace, paths, **kw):
+        return merge_results([add_paths(workspace, [path]) for path in paths])
+    cmd.add_paths = per_file
+    return cmd
+
+
+def bench_save(cmd_cls, count, per_file=False):
+    root = tempfile.mkdtemp()
+    try:
+        cmd = cmd_cls()
+        if per_file:
+            per_file_add_paths(cmd)
+        cmd.set_committer('Bench', 'bench@example.com')
+        workspace = CmdWorkspace(root, cmd)
+        for i in range(count):
+            filename = os.path.join(root, 'file%06d' % i)
+            with open(filename, 'w') as fd:
+                fd.write('content %d\n' % i)
+            workspace.add_file(filename)
+        start = time.perf_counter()
+        workspace.save(message='benchmark')
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--counts', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--backends', nargs='+', default=backend_names)
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    print('%-10s %8s %12s %12s' % ('backend', 'files', 'batched', 'per-file'))
+    for name in options.backends:
+        cmd_cls = get_cmd_by_name(name)
+        if cmd_cls is None:
+            print('%-10s unavailable' % name)
+            continue
+        for count in options.counts:
+            batched = bench_save(cmd_cls, count)
+            per_file = bench_save(cmd_cls, count, per_file=True)
+            print('%-10s %8d %11.3fs %11.3fs' % (
+                name, count, batched, per_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+Benchmark the operations of every backend against local repositories.
+
+For each available backend and number of files, a remote repository is
+seeded with that many files, against which init, clone, read_remote,
+pull, push and save (of that many new files) are timed over a number of
+repetitions.  The authenticated backends access the remote through a
+local smart HTTP server requiring the authorization header, in place of
+a PMR instance.  The time taken to import the commands by a fresh
+interpreter is also measured.  Nothing is accessed over the network.
+
+The results are written as a table, or as JSON or CSV for tracking
+regressions across runs.
+
+Usage::
+
+    python benchmarks/bench_suite.py [--files 10 100] [--repeat 5]
+        [--backends git dulwich] [--format json] [--output results.json]
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# importing the cmd module registers the backends.
+import pmr2.wfctrl.cmd
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.core import get_cmd_by_name
+
+try:
+    from pmr2.wfctrl.testing.gitserver import GitHttpServer
+except ImportError:  # pragma: no cover
+    GitHttpServer = None
+
+authorization = 'Basic username:password'
+
+backend_names = ['git', 'mercurial', 'dulwich', 'authenticated_git',
+                 'authenticated_dulwich']
+operations = ['init', 'clone', 'read_remote', 'pull', 'push', 'save']
+
+# the backends of the plain repository formats, used to create remotes.
+_format_backends = {
+    'git': ['git', 'dulwich'],
+    'hg': ['mercurial'],
+}
+
+
+def write_files(root, prefix, count):
+    paths = []
+    for i in range(count):
+        filename = os.path.join(root, '%s%06d' % (prefix, i))
+        with open(filename, 'w') as fd:
+            fd.write('%s content %d\n' % (prefix, i))
+        paths.append(filename)
+    return paths
+
+
+def make_remote(root, cmd_cls, files):
+    """
+    Create a remote repository within root holding the given number of
+    files, committed and pushed by a seeding workspace.
+    """
+
+    remote = os.path.join(root, 'remote')
+    if cmd_cls.marker == '.hg':
+        cmd_cls._execute(['init', remote])
+    elif cmd_cls.name == 'git':
+        cmd_cls._execute(['init', '--bare', remote])
+    else:
+        from dulwich import porcelain
+        porcelain.init(remote, bare=True)
+
+    cmd = cmd_cls(remote=remote)
+    cmd.set_committer('Bench', 'bench@example.com')
+    seed = CmdWorkspace(os.path.join(root, 'seed'), cmd)
+    for filename in write_files(seed.working_dir, 'file', files):
+        seed.add_file(filename)
+    seed.save(message='seed')
+    cmd.close()
+    return remote
+
+
+class Context(object):
+    """
+    The commands and workspaces of one backend against one remote,
+    created in scratch.
+    """
+
+    def __init__(self, cmd_cls, remote, scratch, files):
+        self.cmd_cls = cmd_cls
+        self.remote = remote
+        self.scratch = scratch
+        self.files = files
+        os.makedirs(scratch)
+        self._count = 0
+        self._cmds = []
+        self._upstream = self._downstream = None
+
+    def cmd(self, remote=None):
+        cmd = self.cmd_cls(remote=remote)
+        if hasattr(cmd, 'set_authorization'):
+            cmd.set_authorization(authorization)
+        cmd.set_committer('Bench', 'bench@example.com')
+        self._cmds.append(cmd)
+        return cmd
+
+    def target(self, name):
+        self._count += 1
+        return os.path.join(self.scratch, '%s%d' % (name, self._count))
+
+    def clone(self, name):
+        return CmdWorkspace(self.target(name), self.cmd(self.remote))
+
+    @property
+    def upstream(self):
+        if self._upstream is None:
+            self._upstream = self.clone('upstream')
+        return self._upstream
+
+    @property
+    def downstream(self):
+        if self._downstream is None:
+            self._downstream = self.clone('downstream')
+        return self._downstream
+
+    def commit(self, workspace):
+        # a new commit within workspace, not yet pushed.
+        filename, = write_files(
+            workspace.working_dir, 'change%d_' % self._count, 1)
+        self._count += 1
+        workspace.cmd.add_paths(workspace, [filename])
+        workspace.cmd.commit(workspace, 'change')
+
+    def close(self):
+        for cmd in self._cmds:
+            cmd.close()
+
+
+def timed(f, *a, **kw):
+    start = time.perf_counter()
+    f(*a, **kw)
+    return time.perf_counter() - start
+
+
+def op_init(ctx):
+    workspace = CmdWorkspace(ctx.target('init'))
+    # not all the backends create the directory.
+    os.makedirs(workspace.working_dir)
+    return timed(ctx.cmd().init_new, workspace)
+
+
+def op_clone(ctx):
+    workspace = CmdWorkspace(ctx.target('clone'))
+    return timed(ctx.cmd(ctx.remote).clone, workspace)
+
+
+def op_read_remote(ctx, calls=100):
+    # the uncached read, averaged as it is otherwise too quick to time.
+    workspace = ctx.downstream
+    cmd = workspace.cmd
+    start = time.perf_counter()
+    for i in range(calls):
+        cmd.read_remote(workspace)
+    return (time.perf_counter() - start) / calls
+
+
+def op_pull(ctx):
+    ctx.downstream
+    upstream = ctx.upstream
+    ctx.commit(upstream)
+    upstream.cmd.push(upstream)
+    return timed(ctx.downstream.cmd.pull, ctx.downstream)
+
+
+def op_push(ctx):
+    upstream = ctx.upstream
+    ctx.commit(upstream)
+    return timed(upstream.cmd.push, upstream)
+
+
+def op_save(ctx):
+    workspace = ctx.clone('save')
+    prefix = 'save%d_' % ctx._count
+    for filename in write_files(workspace.working_dir, prefix, ctx.files):
+        workspace.add_file(filename)
+    return timed(workspace.save, message='benchmark')
+
+
+def bench_import(repeat):
+    code = ('import time; start = time.perf_counter(); '
+            'import pmr2.wfctrl.cmd; print(time.perf_counter() - start)')
+    times = []
+    for i in range(repeat):
+        stdout = subprocess.check_output([sys.executable, '-c', code])
+        times.append(float(stdout))
+    return times
+
+
+@contextmanager
+def served(root, remote, http):
+    # the location of remote, through the local HTTP server if needed.
+    if not http:
+        yield remote
+        return
+    with GitHttpServer(root, authorization=authorization) as server:
+        yield server.url_for(os.path.relpath(remote, root))
+
+
+def result(backend, operation, files, times=None, error=None):
+    entry = {
+        'backend': backend,
+        'operation': operation,
+        'files': files,
+        'times': times or [],
+    }
+    if times:
+        entry['min'] = min(times)
+        entry['median'] = statistics.median(times)
+        entry['mean'] = statistics.mean(times)
+    if error:
+        entry['error'] = error
+    return entry
+
+
+def bench_backend(name, files, repeat, ops):
+    """
+    Return the results of the operations of the named backend against
+    a remote of the given number of files.
+    """
+
+    cmd_cls = get_cmd_by_name(name)
+    http = name.startswith('authenticated_')
+    if cmd_cls is None or (http and GitHttpServer is None):
+        return [result(name, op, files, error='unavailable') for op in ops]
+    plain_cls = None
+    for plain in _format_backends['hg' if cmd_cls.marker == '.hg' else 'git']:
+        plain_cls = get_cmd_by_name(plain)
+        if plain_cls is not None:
+            break
+
+    results = []
+    root = tempfile.mkdtemp()
+    try:
+        remote = make_remote(root, plain_cls, files)
+        with served(root, remote, http) as location:
+            ctx = Context(cmd_cls, location, os.path.join(root, 'scratch'),
+                          files)
+            try:
+                for op in ops:
+                    f = globals()['op_' + op]
+                    try:
+                        times = [f(ctx) for i in range(repeat)]
+                    except Exception as e:
+                        results.append(result(name, op, files, error=repr(e)))
+                    else:
+                        results.append(result(name, op, files, times))
+            finally:
+                ctx.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def _version(args):
+    try:
+        return subprocess.check_output(
+            args, stderr=subprocess.STDOUT).decode('utf8').splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def metadata():
+    try:
+        import dulwich
+        dulwich_version = '.'.join(str(i) for i in dulwich.__version__)
+    except ImportError:
+        dulwich_version = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'git': _version(['git', '--version']),
+        'mercurial': _version(['hg', '--version', '--quiet']),
+        'dulwich': dulwich_version,
+    }
+
+
+def format_table(report):
+    lines = ['%-22s %-12s %7s %10s %10s %10s' % (
+        'backend', 'operation', 'files', 'min', 'median', 'mean')]
+    for entry in report['results']:
+        files = '' if entry['files'] is None else entry['files']
+        if 'error' in entry:
+            lines.append('%-22s %-12s %7s %s' % (
+                entry['backend'], entry['operation'], files, entry['error']))
+            continue
+        lines.append('%-22s %-12s %7s %9.4fs %9.4fs %9.4fs' % (
+            entry['backend'], entry['operation'], files,
+            entry['min'], entry['median'], entry['mean']))
+    return '\n'.join(lines) + '\n'
+
+
+def format_csv(report):
+    fields = ['backend', 'operation', 'files', 'min', 'median', 'mean',
+              'error']
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fields, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(report['results'])
+    return output.getvalue()
+
+
+def format_json(report):
+    return json.dumps(report, indent=2) + '\n'
+
+
+formats = {
+    'table': format_table,
+    'csv': format_csv,
+    'json': format_json,
+}
+
+
+def run(files=(10, 100), repeat=5, backends=backend_names, ops=operations):
+    """
+    Run the benchmarks, returning the report as a dict of the metadata
+    of the environment and the list of results.
+    """
+
+    results = [result('none', 'import', None, bench_import(repeat))]
+    for name in backends:
+        for count in files:
+            results.extend(bench_backend(name, count, repeat, ops))
+    return {'metadata': metadata(), 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backends', nargs='+', default=backend_names)
+    parser.add_argument('--operations', nargs='+', default=operations,
+                        choices=operations)
+    parser.add_argument('--format', default='table', choices=sorted(formats))
+    parser.add_argument('--output', default='-')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    report = run(options.files, options.repeat, options.backends,
+                 options.operations)
+    output = formats[options.format](report)
+    if options.output == '-':
+        sys.stdout.write(output)
+    else:
+        with open(options.output, 'w') as fd:
+            fd.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -40,5 +40,7 @@ setup(name='pmr2.wfctrl',
       },
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      pmr2-wfctrl = pmr2.wfctrl.cli:main
       """,
       )
@@ -0,0 +1,430 @@
+"""
+Asynchronous (asyncio) counterparts of the commands and workspaces.
+
+The binary based commands run their external command on the event loop
+through ``asyncio.create_subprocess_exec``, while the operations that
+cannot be expressed that way (e.g. the dulwich backends, which block on
+network access) are run in an executor.
+"""
+
+import asyncio
+import contextvars
+import copy
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from os.path import join, lexists
+from subprocess import PIPE
+
+from .core import BaseDvcsCmdBin
+from .core import CmdWorkspace
+from .core import _span_stack
+from .core import merge_results
+from .instrument import Execution
+from .instrument import Span
+from .instrument import notify
+from .utils import TIMEOUT_RETURN_CODE
+from .utils import CmdResult
+from .utils import kill_process
+from .utils import popen_kw
+from .utils import redact
+
+logger = logging.getLogger(__name__)
+
+# The span of the operation being awaited within the current task, the
+# counterpart of the span stack kept for each thread by the commands.
+_current_span = contextvars.ContextVar('pmr2.wfctrl.aio.span', default=None)
+
+
+def _unwrap(workspace):
+    # accept both the asynchronous and the plain workspaces.
+    return getattr(workspace, 'workspace', workspace)
+
+
+def _run_in_span(span, f, *a, **kw):
+    # Run f within a thread of the executor as nested in the span of the
+    # task awaiting it, such that the spans and executions reported by
+    # the command are attributed to it.
+    if span is None:
+        return f(*a, **kw)
+    stack = _span_stack()
+    stack.append(span)
+    try:
+        return f(*a, **kw)
+    finally:
+        stack.pop()
+
+
+class AsyncDvcsCmd(object):
+    """
+    Asynchronous counterpart of a BaseDvcsCmd, wrapping a command
+    object such that its operations may be awaited.
+    """
+
+    # The operations of the binary based commands whose results are
+    # only the merged results of the commands they execute, such that
+    # the commands may be determined up front and run on the loop.
+    subprocess_ops = ('clone', 'init_new', 'add', 'add_paths', 'commit',
+                      'pull', 'push')
+
+    def __init__(self, cmd, executor=None, limit=None):
+        """
+        cmd
+            The BaseDvcsCmd to wrap.
+        executor
+            The ``concurrent.futures`` executor for the operations that
+            block, defaults to the default executor of the loop.
+        limit
+            The maximum number of operations that may be running at
+            once through this object.
+        """
+
+        self.cmd = cmd
+        self.executor = executor
+        self.limit = limit
+        self._semaphore = None
+
+    @property
+    def remote(self):
+        return self.cmd.remote
+
+    @remote.setter
+    def remote(self, value):
+        self.cmd.remote = value
+
+    @property
+    def marker(self):
+        return self.cmd.marker
+
+    def set_committer(self, name, email, **kw):
+        return self.cmd.set_committer(name, email, **kw)
+
+    def _get_semaphore(self):
+        if self._semaphore is None and self.limit:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def _run_in_executor(self, f, *a, **kw):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(
+            _run_in_span, _current_span.get(), f, *a, **kw))
+
+    @contextmanager
+    def _span(self, name, workspace):
+        # Report the operation to the observers of the wrapped command,
+        # as the synchronous operations are.
+        observers = self.cmd._get_observers()
+        if not observers:
+            yield None
+            return
+        parent = _current_span.get()
+        span = Span(name, self.cmd.name,
+                    getattr(workspace, 'working_dir', None), parent)
+        if parent is not None:
+            parent.children.append(span)
+        token = _current_span.set(span)
+        notify(observers, 'span_started', span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish(error)
+            notify(observers, 'span_finished', span)
+
+    def _plan(self, name, *a, **kw):
+        # Run the operation against a copy of the command that records
+        # the commands it would execute instead of executing them.
+        calls = []
+
+        def execute(*args, **execute_kw):
+            calls.append((args, execute_kw))
+            return b'', b'', 0
+
+        planner = copy.copy(self.cmd)
+        planner.execute = execute
+        planner.instrumented = False
+        getattr(planner, name)(*a, **kw)
+        return calls
+
+    def _planned(self, name, workspace, *a, **kw):
+        # Whether the operation may be run as the commands planned for
+        # it, which excludes those depending on the outcome of these.
+        if (name not in self.subprocess_ops or
+                not isinstance(self.cmd, BaseDvcsCmdBin)):
+            return False
+        if name == 'clone' and self.cmd.cache_path() is not None:
+            # the cache is updated under its lock, and checked.
+            return False
+        if name == 'add_paths' and not all(
+                lexists(join(workspace.working_dir, path)) for path in a[0]):
+            # the missing paths are looked up in the index.
+            return False
+        return True
+
+    async def execute(self, *args, callback=None, timeout=None):
+        """
+        Executes the external command of the wrapped binary based
+        command on the loop, returning a CmdResult.  Cancelling the
+        task kills the command.
+
+        callback
+            If provided, the output is passed to it as it arrives, as
+            callback('stdout', chunk) or callback('stderr', chunk),
+            rather than being collected and returned.
+        timeout
+            The number of seconds the command may take before it is
+            killed, defaults to the timeout of the wrapped command.
+        """
+
+        observers = self.cmd._get_observers()
+        if not observers:
+            return await self._execute(
+                *args, callback=callback, timeout=timeout)
+        counts = [0, 0]
+        if callback is not None:
+            def counting(name, chunk, callback=callback):
+                counts[name == 'stderr'] += len(chunk)
+                return callback(name, chunk)
+            callback = counting
+        start = time.perf_counter()
+        result = await self._execute(
+            *args, callback=callback, timeout=timeout)
+        span = _current_span.get()
+        execution = Execution(
+            [redact(str(arg)) for arg in (self.cmd.cmd_binary,) + args],
+            time.perf_counter() - start,
+            len(result[0]) + counts[0], len(result[1]) + counts[1],
+            result[2], span)
+        if span is not None:
+            span.executions.append(execution)
+        notify(observers, 'executed', execution)
+        return result
+
+    async def _execute(self, *args, callback=None, timeout=None):
+        if timeout is None:
+            timeout = getattr(self.cmd, 'timeout', None)
+        process = await asyncio.create_subprocess_exec(
+            self.cmd.cmd_binary, *args,
+            stdin=PIPE, stdout=PIPE, stderr=PIPE, **popen_kw())
+
+        async def relay(name, stream):
+            while True:
+                chunk = await stream.read(8192)
+                if not chunk:
+                    break
+                callback(name, chunk)
+
+        try:
+            if callback is None:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(), timeout)
+                return CmdResult(stdout, stderr, process.returncode)
+            process.stdin.close()
+            await asyncio.wait_for(asyncio.gather(
+                relay('stdout', process.stdout),
+                relay('stderr', process.stderr)), timeout)
+            return CmdResult(b'', b'', await process.wait())
+        except asyncio.TimeoutError:
+            kill_process(process)
+            await process.wait()
+            logger.warning('`%s` killed after exceeding the timeout of %ss',
+                           self.cmd.cmd_binary, timeout)
+            return CmdResult(
+                b'', ('killed after exceeding the timeout of %ss\n' %
+                      timeout).encode('utf8'),
+                TIMEOUT_RETURN_CODE, timed_out=True)
+        except asyncio.CancelledError:
+            kill_process(process)
+            # reaped, such that its transport is closed while the loop
+            # is still running, even should this be cancelled again.
+            await asyncio.shield(process.wait())
+            raise
+
+    async def _call(self, name, workspace, *a, **kw):
+        workspace = _unwrap(workspace)
+        semaphore = self._get_semaphore()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            with self._span(name, workspace):
+                return await self._call_op(name, workspace, *a, **kw)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    async def _call_op(self, name, workspace, *a, **kw):
+        if self._planned(name, workspace, *a, **kw):
+            if name in ('pull', 'push'):
+                # so that the remote is not read through the recording
+                # execute of the planner.
+                _run_in_span(_current_span.get(),
+                             self.cmd._cached_read_remote, workspace)
+            start = time.perf_counter()
+            results = []
+            for args, execute_kw in self._plan(name, workspace, *a, **kw):
+                results.append(await self.execute(*args, **execute_kw))
+            result = merge_results(results, operation=name)
+            result.duration = time.perf_counter() - start
+            return result
+        return await self._run_in_executor(
+            getattr(self.cmd, name), workspace, *a, **kw)
+
+    async def clone(self, workspace, **kw):
+        return await self._call('clone', workspace, **kw)
+
+    async def init_new(self, workspace, **kw):
+        return await self._call('init_new', workspace, **kw)
+
+    async def add(self, workspace, path, **kw):
+        return await self._call('add', workspace, path, **kw)
+
+    async def add_paths(self, workspace, paths, **kw):
+        return await self._call('add_paths', workspace, list(paths), **kw)
+
+    async def commit(self, workspace, message, **kw):
+        return await self._call('commit', workspace, message, **kw)
+
+    async def read_remote(self, workspace, target_remote=None, **kw):
+        return await self._call(
+            'read_remote', workspace, target_remote=target_remote, **kw)
+
+    async def write_remote(self, workspace, target_remote=None, **kw):
+        return await self._call(
+            'write_remote', workspace, target_remote=target_remote, **kw)
+
+    async def update_remote(self, workspace):
+        return await self._call('update_remote', workspace)
+
+    async def pull(self, workspace, **kw):
+        return await self._call('pull', workspace, **kw)
+
+    async def push(self, workspace, **kw):
+        return await self._call('push', workspace, **kw)
+
+    async def reset_to_remote(self, workspace, **kw):
+        return await self._call('reset_to_remote', workspace, **kw)
+
+    async def read_file(self, workspace, path, rev=None, **kw):
+        return await self._call('read_file', workspace, path, rev=rev, **kw)
+
+    async def status(self, workspace, untracked=True, **kw):
+        return await self._call(
+            'status', workspace, untracked=untracked, **kw)
+
+    async def init(self, workspace, **kw):
+        with self._span('init', _unwrap(workspace)):
+            if self.cmd.remote:
+                return await self.clone(workspace, **kw)
+            return await self.init_new(workspace)
+
+    async def save(self, workspace, message='', **kw):
+        workspace = _unwrap(workspace)
+        paths = workspace.get_changed_subpaths()
+        logger.debug('Add paths count={0}'.format(len(paths)))
+        start = time.perf_counter()
+        results = []
+        with self._span('save', workspace), self.cmd.session(workspace):
+            if paths:
+                added = await self.add_paths(workspace, paths)
+                commit = await self.commit(workspace, message)
+                results.extend([added, commit])
+                if not merge_results([added, commit])[2]:
+                    workspace.update_stat_cache()
+            else:
+                logger.debug('no changed paths, not committing')
+            results.append(await self.update_remote(workspace))
+            results.append(await self.push(workspace))
+        result = merge_results(results, operation='save')
+        result.duration = time.perf_counter() - start
+        return result
+
+    async def close(self):
+        await self._run_in_executor(self.cmd.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncCmdWorkspace(object):
+    """
+    Asynchronous counterpart of CmdWorkspace.  The workspace is only
+    initialized when ``initialize`` is awaited.
+    """
+
+    def __init__(self, working_dir, cmd=None, auto=False, **kw):
+        """
+        cmd
+            An AsyncDvcsCmd, or a command object to be wrapped by one.
+        """
+
+        if cmd is not None and not isinstance(cmd, AsyncDvcsCmd):
+            cmd = AsyncDvcsCmd(cmd)
+        # The markers of the automatically detected commands already
+        # exist, so constructing the workspace will not initialize it.
+        self.workspace = CmdWorkspace(working_dir, auto=auto, **kw)
+        if cmd is None and self.workspace.cmd is not None:
+            cmd = AsyncDvcsCmd(self.workspace.cmd)
+        elif cmd is not None:
+            self.workspace.cmd = cmd.cmd
+            self.workspace.update_cmd_table(cmd.cmd)
+        self.cmd = cmd
+
+    @property
+    def working_dir(self):
+        return self.workspace.working_dir
+
+    @property
+    def marker(self):
+        return self.workspace.marker
+
+    def add_file(self, filename):
+        return self.workspace.add_file(filename)
+
+    def add_files(self, filenames):
+        return self.workspace.add_files(filenames)
+
+    def add_dir(self, path='', **kw):
+        return self.workspace.add_dir(path, **kw)
+
+    def add_glob(self, pattern, **kw):
+        return self.workspace.add_glob(pattern, **kw)
+
+    def iter_tracked_subpaths(self, relative=False):
+        return self.workspace.iter_tracked_subpaths(relative=relative)
+
+    def get_tracked_subpaths(self, relative=False):
+        return self.workspace.get_tracked_subpaths(relative=relative)
+
+    def check_marker(self):
+        return self.workspace.check_marker()
+
+    async def initialize(self, **kw):
+        if self.check_marker() or self.cmd is None:
+            logger.debug('already initialized: %s', self.working_dir)
+            return
+        return await self.cmd.init(
+            self.workspace, **dict(self.workspace.clone_kw, **kw))
+
+    async def save(self, **kw):
+        if self.cmd is None:
+            return
+        return await self.cmd.save(self.workspace, **kw)
+
+    async def status(self, **kw):
+        if self.cmd is None:
+            return None
+        return await self.cmd.status(self.workspace, **kw)
+
+    async def pull(self, **kw):
+        return await self.cmd.pull(self.workspace, **kw)
+
+    async def push(self, **kw):
+        return await self.cmd.push(self.workspace, **kw)
@@ -0,0 +1,233 @@
+"""
+The ``pmr2-wfctrl`` command, operating on every workspace within a
+directory tree at once.
+
+Usage::
+
+    pmr2-wfctrl scan ROOT [--workers 8] [--max-depth 3]
+    pmr2-wfctrl status ROOT [--backend git]
+    pmr2-wfctrl pull-all ROOT [--host-limit 2] [--fail-fast]
+    pmr2-wfctrl push-all ROOT
+"""
+
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import relpath
+
+# importing the cmd module registers the backends.
+import pmr2.wfctrl.cmd
+from . import core
+from .core import CmdWorkspace
+from .core import get_cmd_by_name
+from .discover import discover_workspaces
+from .sync import SyncManager
+
+logger = logging.getLogger(__name__)
+
+
+def _name(path, root):
+    # the workspace as shown, relative to the root that was scanned.
+    return relpath(path, root)
+
+
+def _backend_name(cmd):
+    return getattr(cmd, 'name', None) or type(cmd).__name__
+
+
+def find_workspaces(options):
+    """
+    Return the CmdWorkspace for each workspace within the root of the
+    options, through the backend requested if any, along with the time
+    taken to find them.
+    """
+
+    start = time.perf_counter()
+    found = discover_workspaces(
+        options.root, max_workers=options.workers,
+        max_depth=options.max_depth)
+    cmd_cls = options.backend and get_cmd_by_name(options.backend)
+    workspaces = []
+    for path, detected in found.items():
+        if not cmd_cls:
+            # the recorded marker spares the workspace from probing.
+            workspaces.append(CmdWorkspace(path, auto=True))
+        elif cmd_cls.marker == detected.marker:
+            workspaces.append(CmdWorkspace(path, cmd_cls()))
+    return workspaces, time.perf_counter() - start
+
+
+def workspace_status(workspace):
+    """
+    Return the status of the workspace as a dict.
+    """
+
+    start = time.perf_counter()
+    cmd = workspace.cmd
+    remote = cmd._cached_read_remote(workspace)
+    if isinstance(remote, bytes):
+        remote = remote.decode('utf8', 'replace')
+    try:
+        changes = workspace.status()
+    except NotImplementedError:
+        changes = None
+    return {
+        'backend': _backend_name(cmd),
+        'remote': remote,
+        'changes': changes,
+        'elapsed': time.perf_counter() - start,
+    }
+
+
+def _changes(changes):
+    if changes is None:
+        return 'unknown'
+    if not changes:
+        return 'clean'
+    return '%d changed' % len(changes)
+
+
+def _summary(count, elapsed, failed=0):
+    line = '%d workspace%s in %.3fs' % (
+        count, '' if count == 1 else 's', elapsed)
+    if failed:
+        line += ', %d failed' % failed
+    return line
+
+
+def run_scan(options, out):
+    workspaces, elapsed = find_workspaces(options)
+    for workspace in workspaces:
+        out.write('%-22s %s\n' % (
+            _backend_name(workspace.cmd),
+            _name(workspace.working_dir, options.root)))
+    out.write(_summary(len(workspaces), elapsed) + '\n')
+    return 0
+
+
+def run_status(options, out):
+    workspaces, elapsed = find_workspaces(options)
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=options.workers) as executor:
+        futures = [executor.submit(workspace_status, workspace)
+                   for workspace in workspaces]
+        for workspace, future in zip(workspaces, futures):
+            name = _name(workspace.working_dir, options.root)
+            try:
+                status = future.result()
+            except Exception as e:
+                failed += 1
+                logger.warning('status failed on %s: %s', name, e)
+                out.write('%8s  %-22s %s  error: %s\n' % (
+                    '', _backend_name(workspace.cmd), name, e))
+                continue
+            out.write('%7.3fs  %-22s %s  %s  %s\n' % (
+                status['elapsed'], status['backend'], name,
+                _changes(status['changes']),
+                status['remote'] or '(no remote)'))
+    out.write(_summary(
+        len(workspaces), elapsed + time.perf_counter() - start, failed) + '\n')
+    return 1 if failed else 0
+
+
+def run_sync(options, out):
+    workspaces, elapsed = find_workspaces(options)
+    manager = SyncManager(
+        workspaces, max_workers=options.workers,
+        host_limit=options.host_limit, fail_fast=options.fail_fast)
+    start = time.perf_counter()
+    results = manager.run(options.action)
+    failed = 0
+    for result in results:
+        name = _name(result.workspace.working_dir, options.root)
+        backend = _backend_name(result.workspace.cmd)
+        if result.skipped:
+            out.write('%8s  %-22s %s  skipped\n' % ('', backend, name))
+            continue
+        if result.ok:
+            out.write('%7.3fs  %-22s %s  ok\n' % (
+                result.elapsed, backend, name))
+            continue
+        failed += 1
+        if result.error is not None:
+            out.write('%8s  %-22s %s  error: %s\n' % (
+                '', backend, name, result.error))
+            continue
+        out.write('%7.3fs  %-22s %s  failed (%s)\n' % (
+            result.elapsed, backend, name, result.return_code))
+        for line in result.stderr.decode('utf8', 'replace').splitlines():
+            out.write('    %s\n' % line)
+    slowest = max((r for r in results if r.elapsed is not None),
+                  key=lambda r: r.elapsed, default=None)
+    out.write(_summary(
+        len(results), elapsed + time.perf_counter() - start, failed) + '\n')
+    if slowest is not None:
+        out.write('slowest: %s (%.3fs)\n' % (
+            _name(slowest.workspace.working_dir, options.root),
+            slowest.elapsed))
+    return 1 if failed else 0
+
+
+def make_parser():
+    backends = sorted(set(
+        cmd_cls.name for cmd_cls in core._cmd_classes
+        if getattr(cmd_cls, 'name', None)))
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('root', help='the directory to find workspaces in')
+    common.add_argument(
+        '--workers', type=int, default=4,
+        help='the number of workspaces operated on at once (default: 4)')
+    common.add_argument(
+        '--max-depth', type=int, default=None,
+        help='the number of levels below root to search at most')
+    common.add_argument(
+        '--backend', choices=backends, default=None,
+        help='operate through this backend, only on its workspaces')
+    common.add_argument('-v', '--verbose', action='store_true')
+
+    sync = argparse.ArgumentParser(add_help=False)
+    sync.add_argument(
+        '--host-limit', type=int, default=None,
+        help='the number of workspaces operated on at once per host')
+    sync.add_argument(
+        '--fail-fast', action='store_true',
+        help='stop on the first failure')
+
+    parser = argparse.ArgumentParser(
+        prog='pmr2-wfctrl',
+        description='Operate on every workspace within a directory tree.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser(
+        'scan', parents=[common], help='list the workspaces found'
+    ).set_defaults(run=run_scan)
+    subparsers.add_parser(
+        'status', parents=[common], help='show the status of the workspaces'
+    ).set_defaults(run=run_status)
+    subparsers.add_parser(
+        'pull-all', parents=[common, sync], help='pull every workspace'
+    ).set_defaults(run=run_sync, action='pull')
+    subparsers.add_parser(
+        'push-all', parents=[common, sync], help='push every workspace'
+    ).set_defaults(run=run_sync, action='push')
+    return parser
+
+
+def main(argv=None, out=None):
+    parser = make_parser()
+    options = parser.parse_args(argv)
+    if options.workers < 1:
+        parser.error('--workers must be at least 1')
+    if options.backend and get_cmd_by_name(options.backend) is None:
+        parser.error('backend `%s` is not available' % options.backend)
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.WARNING)
+    return options.run(options, out or sys.stdout)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -1,25 +1,174 @@
 import logging
-from os.path import join, isdir
+import os
+import stat
+from contextlib import contextmanager
+from os.path import abspath, join, isdir, normpath, relpath
 import sys
+import threading
 from io import BytesIO
 
 import urllib3
 
 if sys.version_info > (3, 0):  # pragma: no cover
     from configparser import ConfigParser
+    from configparser import Error as ConfigParserError
+    from urllib.parse import urlsplit
 else:  # pragma: no cover
     from ConfigParser import ConfigParser
+    from ConfigParser import Error as ConfigParserError
+    from urlparse import urlsplit
 
 from pmr2.wfctrl.core import BaseDvcsCmdBin, register_cmd, BaseDvcsCmd
+from pmr2.wfctrl.core import _cache_lock
+from pmr2.wfctrl.core import _stat_signature
+from pmr2.wfctrl.cmdserver import HgCmdServer
+from pmr2.wfctrl.utils import link_tree
+from pmr2.wfctrl.utils import local_path
 
 try:
     from dulwich import porcelain
-    from dulwich.errors import NotGitRepository
+    from dulwich.client import get_transport_and_path
+    from dulwich.errors import NotGitRepository, NotTreeError
+    from dulwich.index import blob_from_path_and_stat
+    from dulwich.object_store import tree_lookup_path
+    from dulwich.objectspec import parse_commit
+    from dulwich.repo import Repo
 except ImportError:  # pragma: no cover
     dulwich_available = False
+    Repo = object
 
 logger = logging.getLogger(__name__)
 
+# The mode of the submodules within the index.
+_S_IFGITLINK = 0o160000
+
+
+class _CallbackStream(object):
+    # A file like object that passes what is written to the callback,
+    # for the output streams of porcelain.
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+
+    def write(self, data):
+        if data:
+            self.callback(self.name, bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return b''
+
+
+def _output_streams(callback=None):
+    if callback is None:
+        return BytesIO(), BytesIO()
+    return (_CallbackStream(callback, 'stdout'),
+            _CallbackStream(callback, 'stderr'))
+
+
+def _subpath(workspace, path):
+    # the path relative to the root of the workspace, with the '/'
+    # separator as used by the repositories.
+    path = abspath(normpath(join(workspace.working_dir, path)))
+    return relpath(path, workspace.working_dir).replace('\\', '/')
+
+
+def _decode_path(path):
+    # the path within a repository as bytes to the str used by status.
+    return path.decode('utf8', 'surrogateescape')
+
+
+def _sorted_status(status):
+    return dict(sorted(status.items()))
+
+
+# The states reported by status for the codes of ``hg status``.
+_hg_status_states = {
+    b'M': 'modified',
+    b'A': 'added',
+    b'R': 'removed',
+    b'!': 'missing',
+    b'?': 'untracked',
+}
+
+
+class _GitStatusParser(object):
+    # Parse the NUL terminated records of `git status --porcelain=v2 -z`
+    # as the output arrives, being the callback for execute.
+
+    # The number of space separated fields before the path of the
+    # ordinary, renamed or copied, and unmerged entries.
+    fields = {b'1': 8, b'2': 9, b'u': 10}
+
+    def __init__(self):
+        self.status = {}
+        self.stderr = []
+        self._buffer = b''
+        # the state of the original path that follows a renamed or
+        # copied entry, or None if that is not expected.
+        self._source = None
+
+    def __call__(self, name, chunk):
+        if name != 'stdout':
+            self.stderr.append(chunk)
+            return
+        records = (self._buffer + chunk).split(b'\0')
+        self._buffer = records.pop()
+        for record in records:
+            self.parse(record)
+
+    def parse(self, record):
+        if self._source is not None:
+            state, self._source = self._source, None
+            if state:
+                self.status[_decode_path(record)] = state
+            return
+        kind = record[:1]
+        if kind == b'?':
+            self.status[_decode_path(record[2:])] = 'untracked'
+            return
+        count = self.fields.get(kind)
+        if count is None:
+            # the ignored entries and the headers.
+            return
+        fields = record.split(b' ', count)
+        index, worktree = fields[1][:1], fields[1][1:2]
+        if kind == b'2':
+            # a copy leaves its original path as it was.
+            self._source = 'removed' if index == b'R' else ''
+        if kind == b'u':
+            state = 'modified'
+        elif worktree == b'D':
+            state = 'missing'
+        elif index in (b'A', b'R', b'C'):
+            state = 'added'
+        elif index == b'D':
+            state = 'removed'
+        else:
+            state = 'modified'
+        self.status[_decode_path(fields[-1])] = state
+
+
+def _index_stat_matches(entry, st, index_mtime):
+    # Whether the stat of a file matches the one recorded for it by the
+    # index, such that its contents need not be compared, unless it was
+    # modified within the second the index was written, when changes
+    # made after the index was written cannot be told apart.
+    mtime = entry.mtime
+    if isinstance(mtime, tuple):
+        sec, nsec = mtime
+    else:
+        sec, nsec = int(mtime), 0
+    if entry.size != st.st_size & 0xffffffff or int(st.st_mtime) != sec:
+        return False
+    if nsec and st.st_mtime_ns % 1000000000 != nsec:
+        return False
+    return sec < int(index_mtime)
+
 
 class DemoDvcsCmd(BaseDvcsCmdBin):
     binary = 'vcs'
@@ -63,19 +212,76 @@ class MercurialDvcsCmd(BaseDvcsCmdBin):
     marker = '.hg'
     default_remote = 'default'
     _hgrc = 'hgrc'
+    remote_config = _hgrc
     _committer = None
+    _server = None
+    _process_attrs = BaseDvcsCmdBin._process_attrs + ('_server',)
+
+    def __init__(self, remote=None, cmd_binary=None, cmdserver=False,
+                 timeout=None, cache_dir=None):
+        """
+        cmdserver
+            Execute all commands through a single command server
+            process for the lifetime of this object (or until close),
+            instead of starting hg for every command.
+        timeout
+            The default number of seconds a command may take.
+        cache_dir
+            Clone through the pooled storage of the share extension
+            within this directory, such that repeated clones of a
+            remote only pull what is new and share its store.
+        """
+
+        super(MercurialDvcsCmd, self).__init__(
+            remote=remote, cmd_binary=cmd_binary, timeout=timeout,
+            cache_dir=cache_dir)
+        self.cmdserver = cmdserver
 
     def _args(self, workspace, *args):
         result = ['-R', workspace.working_dir]
         result.extend(args)
         return result
 
+    def execute(self, *args, callback=None, timeout=None):
+        if not self.cmdserver:
+            return super(MercurialDvcsCmd, self).execute(
+                *args, callback=callback, timeout=timeout)
+        if self._server is None:
+            self._server = HgCmdServer(self.cmd_binary)
+        if timeout is None:
+            timeout = self.timeout
+        return self._server.runcommand(
+            *args, callback=callback, timeout=timeout)
+
+    def cancel(self):
+        count = super(MercurialDvcsCmd, self).cancel()
+        server = self._server
+        if server is not None and server.cancel():
+            count += 1
+        return count
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.close()
+
     def set_committer(self, name, email, **kw):
         # TODO persist config.
         self._committer = '%s <%s>' % (name, email)
 
-    def clone(self, workspace, **kw):
-        return self.execute('clone', self.remote, workspace.working_dir)
+    def _cache_args(self):
+        # hg already hard links the store of a local repository.
+        if not self.cache_dir or local_path(self.remote):
+            return []
+        # the stores are pooled by the root changeset, so all the
+        # remotes of a repository share one.
+        return ['--config', 'extensions.share=',
+                '--config', 'share.pool=%s' % self.cache_dir]
+
+    def clone(self, workspace, callback=None, timeout=None, **kw):
+        return self.execute(*(self._cache_args() + [
+            'clone', self.remote, workspace.working_dir]),
+            callback=callback, timeout=timeout)
 
     def init_new(self, workspace, **kw):
         return self.execute('init', workspace.working_dir)
@@ -83,6 +289,9 @@ class MercurialDvcsCmd(BaseDvcsCmdBin):
     def add(self, workspace, path, **kw):
         return self.execute(*self._args(workspace, 'add', path))
 
+    def add_paths(self, workspace, paths, **kw):
+        return self.execute_chunked(self._args(workspace, 'add', '--'), paths)
+
     def commit(self, workspace, message, **kw):
         # XXX need to customize the user name
         cmd = ['commit', '-m', message]
@@ -108,21 +317,25 @@ class MercurialDvcsCmd(BaseDvcsCmdBin):
         cp.set('paths', target_remote, self.remote)
         with open(target, 'w') as fd:
             cp.write(fd)
+        self._invalidate_remote(workspace)
+        return b'', b'', 0
 
-    def pull(self, workspace, username=None, password=None, **kw):
+    def pull(self, workspace, username=None, password=None, callback=None,
+             timeout=None, **kw):
         # XXX origin may be undefined
         target = self.get_remote(workspace,
                                  username=username, password=password)
         # XXX assuming repo is clean
         args = self._args(workspace, 'pull', target)
-        return self.execute(*args)
+        return self.execute(*args, callback=callback, timeout=timeout)
 
-    def push(self, workspace, username=None, password=None, **kw):
+    def push(self, workspace, username=None, password=None, callback=None,
+             timeout=None, **kw):
         # XXX origin may be undefined
         push_target = self.get_remote(workspace,
                                       username=username, password=password)
         args = self._args(workspace, 'push', push_target)
-        return self.execute(*args)
+        return self.execute(*args, callback=callback, timeout=timeout)
 
     def reset_to_remote(self, workspace, branch=None):
         if branch is None:
@@ -130,6 +343,29 @@ class MercurialDvcsCmd(BaseDvcsCmdBin):
         args = self._args(workspace, 'update', '-C', '-r', branch)
         return self.execute(*args)
 
+    def read_file(self, workspace, path, rev=None, **kw):
+        stdout, err, return_code = self.execute(*self._args(
+            workspace, 'cat', '-r', rev or '.',
+            'path:' + _subpath(workspace, path)))
+        if return_code == 0:
+            return stdout
+
+    def status(self, workspace, untracked=True, **kw):
+        args = ['status', '-0', '-mard']
+        if untracked:
+            args.append('-u')
+        stdout, err, return_code = self.execute(*self._args(workspace, *args))
+        if return_code != 0:
+            logger.warning('unable to read status of %s: %s',
+                           workspace.working_dir, err.strip())
+            return None
+        status = {}
+        for record in stdout.split(b'\0'):
+            state = _hg_status_states.get(record[:1])
+            if state is not None:
+                status[_decode_path(record[2:])] = state
+        return _sorted_status(status)
+
 
 class GitDvcsCmd(BaseDvcsCmdBin):
     cmd_binary = 'git'
@@ -137,8 +373,30 @@ class GitDvcsCmd(BaseDvcsCmdBin):
     marker = '.git'
 
     default_remote = 'origin'
+    remote_config = 'config'
     _committer = (None, None)
 
+    def __init__(self, remote=None, cmd_binary=None, timeout=None,
+                 cache_dir=None, cache_shared=False):
+        """
+        timeout
+            The default number of seconds a command may take.
+        cache_dir
+            Fetch the objects of the remote into a bare repository
+            within this directory before cloning, and clone with it as
+            the reference, such that repeated clones of a remote only
+            fetch what is new.
+        cache_shared
+            Leave the clones borrowing the objects of the cache through
+            their alternates instead of copying them, which is faster
+            but the clones break should the cache be removed.
+        """
+
+        super(GitDvcsCmd, self).__init__(
+            remote=remote, cmd_binary=cmd_binary, timeout=timeout,
+            cache_dir=cache_dir)
+        self.cache_shared = cache_shared
+
     def _args(self, workspace, *args):
         worktree = workspace.working_dir
         gitdir = join(worktree, self.marker)
@@ -149,8 +407,109 @@ class GitDvcsCmd(BaseDvcsCmdBin):
     def set_committer(self, name, email, **kw):
         self._committer = (name, email)
 
-    def clone(self, workspace, **kw):
-        return self.execute('clone', self.remote, workspace.working_dir)
+    def _progress_args(self, callback):
+        # git only reports progress to a terminal unless requested.
+        return ['--progress'] if callback is not None else []
+
+    def _clone_args(self, depth=None, branch=None, single_branch=None,
+                    filter=None, **kw):
+        args = []
+        if depth:
+            args.extend(['--depth', str(depth)])
+        if branch:
+            args.extend(['--branch', branch])
+        if single_branch is not None:
+            args.append(
+                '--single-branch' if single_branch else '--no-single-branch')
+        if filter:
+            # partial clone, e.g. blob:none or tree:0
+            args.append('--filter=%s' % filter)
+        return args
+
+    def _auth_args(self):
+        return []
+
+    def _update_cache(self, callback=None, timeout=None):
+        # Fetch the objects of the remote into the cache, returning its
+        # path, or None if there is no cache to be used.
+        cache = self.cache_path()
+        if cache is None:
+            return None
+        with _cache_lock(cache):
+            if not isdir(cache):
+                _, _, return_code = self.execute(
+                    'init', '--bare', '--quiet', cache)
+                if return_code:
+                    logger.warning('unable to create the object cache %s',
+                                   cache)
+                    return None
+            _, _, return_code = self.execute(
+                *self._auth_args(), '--git-dir=%s' % cache, 'fetch',
+                *(self._progress_args(callback) + [
+                    self.remote, '+refs/heads/*:refs/heads/*',
+                    '+refs/tags/*:refs/tags/*']),
+                callback=callback, timeout=timeout)
+        if return_code:
+            # the clone still references whatever the cache holds.
+            logger.warning('unable to update the object cache %s', cache)
+        return cache
+
+    def _cache_args(self, callback=None, timeout=None, depth=None,
+                    filter=None, **kw):
+        # a shallow or partial clone would have the full history of the
+        # remote fetched into the cache first.
+        if depth or filter:
+            return []
+        cache = self._update_cache(callback, timeout)
+        if cache is None:
+            return []
+        args = ['--reference-if-able', cache]
+        if not self.cache_shared:
+            args.append('--dissociate')
+        return args
+
+    def _clone_source(self, depth=None, filter=None, **kw):
+        # git hard links the objects of a repository cloned by its path
+        # rather than through a file:// url, which is only needed for
+        # a shallow or partial clone.
+        if depth or filter or urlsplit(self.remote).scheme != 'file':
+            return self.remote
+        return local_path(self.remote) or self.remote
+
+    def _restore_origin(self, workspace):
+        # only the url is replaced, keeping the remote-tracking branches
+        # and the upstream of the branch checked out.
+        result = self.execute(*self._args(
+            workspace, 'remote', 'set-url', self.default_remote, self.remote))
+        self._invalidate_remote(workspace)
+        return result
+
+    def clone(self, workspace, callback=None, timeout=None, **kw):
+        """
+        depth
+            Only fetch this many of the latest commits.
+        branch
+            The branch to check out instead of the remote HEAD.
+        single_branch
+            Only fetch the history of the one branch, the default with
+            depth, or all branches if False.
+        filter
+            The partial clone filter, e.g. ``blob:none`` or ``tree:0``,
+            for the objects to be fetched on demand.
+        timeout
+            The number of seconds git may take, instead of the timeout
+            of this object.
+        """
+
+        source = self._clone_source(**kw)
+        result = self.execute('clone', *(
+            self._progress_args(callback) + self._clone_args(**kw) +
+            self._cache_args(callback, timeout, **kw) + [
+                source, workspace.working_dir]),
+            callback=callback, timeout=timeout)
+        if source != self.remote and not result[2]:
+            self._restore_origin(workspace)
+        return result
 
     def init_new(self, workspace, **kw):
         return self.execute('init', workspace.working_dir)
@@ -158,17 +517,70 @@ class GitDvcsCmd(BaseDvcsCmdBin):
     def add(self, workspace, path, **kw):
         return self.execute(*self._args(workspace, 'add', path))
 
-    def commit(self, workspace, message, **kw):
-        # XXX no temporary override as far as I know.
+    def add_paths(self, workspace, paths, **kw):
+        paths = list(paths)
+        # git rejects the entire invocation for a path that is neither
+        # on the filesystem nor in the index, so these are dropped; the
+        # ones in the index are kept to stage their removal.
+        missing = [path for path in paths if not os.path.lexists(
+            join(workspace.working_dir, path))]
+        if missing:
+            stdout, _, _ = self.execute_chunked(
+                self._args(workspace, 'ls-files', '-z', '--'), missing)
+            indexed = set(stdout.split(b'\0'))
+            dropped = set(path for path in missing if _subpath(
+                workspace, path).encode('utf8') not in indexed)
+            if dropped:
+                logger.warning('not adding the missing paths: %s',
+                               ', '.join(sorted(dropped)))
+                paths = [path for path in paths if path not in dropped]
+        if not paths:
+            return b'', b'', 0
+        return self.execute_chunked(self._args(workspace, 'add', '--'), paths)
+
+    def write_committer(self, workspace):
+        """
+        Persist the committer into the configuration of the workspace.
+        """
+
         name, email = self._committer
         if name:
             self.execute(*self._args(workspace, 'config', 'user.name', name))
         if email:
             self.execute(*self._args(workspace, 'config', 'user.email', email))
-        return self.execute(*self._args(workspace, 'commit', '-m', message))
+
+    def commit(self, workspace, message, **kw):
+        # The committer is only applied to this invocation, leaving the
+        # configuration of the workspace untouched.
+        name, email = self._committer
+        args = []
+        if name:
+            args.extend(['-c', 'user.name=%s' % name])
+        if email:
+            args.extend(['-c', 'user.email=%s' % email])
+        args.extend(['commit', '-m', message])
+        return self.execute(*self._args(workspace, *args))
 
     def read_remote(self, workspace, target_remote=None, **kw):
         target_remote = target_remote or self.default_remote
+        # Read the configuration file directly rather than starting git
+        # for what is usually a plain ini file; features that require
+        # git to resolve the url fall back to asking git.
+        target = join(workspace.working_dir, self.marker, self.remote_config)
+        cp = ConfigParser(strict=False, interpolation=None,
+                          allow_no_value=True)
+        try:
+            cp.read(target)
+        except ConfigParserError:
+            return self._read_remote_cmd(workspace, target_remote)
+        for section in cp.sections():
+            if section.split()[0].lower() in ('include', 'includeif', 'url'):
+                return self._read_remote_cmd(workspace, target_remote)
+        section = 'remote "%s"' % target_remote
+        if cp.has_option(section, 'url'):
+            return cp.get(section, 'url')
+
+    def _read_remote_cmd(self, workspace, target_remote):
         stdout, err, return_code = self.execute(*self._args(workspace, 'remote', '-v'))
         if stdout:
             for lines in stdout.splitlines():
@@ -179,34 +591,44 @@ class GitDvcsCmd(BaseDvcsCmdBin):
 
     def write_remote(self, workspace, target_remote=None, **kw):
         target_remote = target_remote or self.default_remote
-        stdout, err, return_code = self.execute(*self._args(workspace, 'remote',
-                                                            'rm', target_remote))
-        stdout, err, return_code = self.execute(*self._args(workspace, 'remote',
-                                                            'add', target_remote, self.remote))
+        # removing a remote that is not defined fails harmlessly.
+        self.execute(*self._args(workspace, 'remote', 'rm', target_remote))
+        result = self.execute(*self._args(workspace, 'remote',
+                                          'add', target_remote, self.remote))
+        self._invalidate_remote(workspace)
+        return result
 
-    def pull(self, workspace, username=None, password=None, **kw):
+    def pull(self, workspace, username=None, password=None, callback=None,
+             timeout=None, **kw):
         # XXX origin may be undefined
         target = self.get_remote(workspace,
                                  username=username, password=password)
         # XXX assuming repo is clean
-        args = self._args(workspace, 'pull', target)
-        return self.execute(*args)
+        args = self._args(workspace, 'pull', *(
+            self._progress_args(callback) + [target]))
+        return self.execute(*args, callback=callback, timeout=timeout)
 
     def push(self, workspace, username=None, password=None, branches=None,
-             **kw):
+             callback=None, timeout=None, **kw):
         """
         branches
             A list of branches to push.  Defaults to --all
+        callback
+            Passed the output of git as it arrives, including progress.
+        timeout
+            The number of seconds git may take, instead of the timeout
+            of this object.
         """
         push_target = self.get_remote(workspace,
                                       username=username, password=password)
-        args = self._args(workspace, 'push', push_target)
+        args = self._args(workspace, 'push', *(
+            self._progress_args(callback) + [push_target]))
         if not branches:
             args.append('--all')
         elif isinstance(branches, list):  # pragma: no cover
             args.extend(branches)
 
-        return self.execute(*args)
+        return self.execute(*args, callback=callback, timeout=timeout)
 
     def reset_to_remote(self, workspace, branch=None):
         # XXX not actually resetting to remote
@@ -217,12 +639,31 @@ class GitDvcsCmd(BaseDvcsCmdBin):
         args = self._args(workspace, 'reset', '--hard', branch)
         return self.execute(*args)
 
+    def read_file(self, workspace, path, rev=None, **kw):
+        name = '%s:%s' % (rev or 'HEAD', _subpath(workspace, path))
+        stdout, err, return_code = self.execute(
+            *self._args(workspace, 'cat-file', 'blob', name))
+        return stdout if return_code == 0 else None
+
+    def status(self, workspace, untracked=True, **kw):
+        parser = _GitStatusParser()
+        result = self.execute(*self._args(
+            workspace, 'status', '--porcelain=v2', '-z',
+            '--untracked-files=%s' % ('all' if untracked else 'no')),
+            callback=parser)
+        if result[2] != 0:
+            logger.warning('unable to read status of %s: %s',
+                           workspace.working_dir,
+                           b''.join(parser.stderr).strip())
+            return None
+        return _sorted_status(parser.status)
+
 
 class AuthenticatedGitDvcsCmd(GitDvcsCmd):
     name = 'authenticated_git'
 
-    def __init__(self, remote=None, cmd_binary=None):
-        super().__init__(remote=remote, cmd_binary=cmd_binary)
+    def __init__(self, remote=None, cmd_binary=None, **kw):
+        super().__init__(remote=remote, cmd_binary=cmd_binary, **kw)
 
         self._auth_header = None
 
@@ -233,23 +674,67 @@ class AuthenticatedGitDvcsCmd(GitDvcsCmd):
         """
         self._auth_header = authorization_header
 
-    def _authenticate(self, workspace):
-        args = ['config', 'http.extraHeader', f'Authorization: {self._auth_header}']
-        return self.execute(*self._args(workspace, *args))
-
-    def clone(self, workspace, **kw):
-        args = ['clone', '--config', f'http.extraHeader=Authorization: {self._auth_header}', self.remote, workspace.working_dir]
-        return self.execute(*args)
+    def _auth_args(self):
+        # The header is only applied to each invocation, so that the
+        # token never gets written to the repository configuration.
+        if self._auth_header is None:
+            return []
+        return ['-c', f'http.extraHeader=Authorization: {self._auth_header}']
+
+    def clone(self, workspace, callback=None, timeout=None, **kw):
+        source = self._clone_source(**kw)
+        result = self.execute(*self._auth_args(), 'clone', *(
+            self._progress_args(callback) + self._clone_args(**kw) +
+            self._cache_args(callback, timeout, **kw) + [
+                source, workspace.working_dir]),
+            callback=callback, timeout=timeout)
+        if source != self.remote and not result[2]:
+            self._restore_origin(workspace)
+        return result
 
-    def pull(self, workspace, **kw):
-        self._authenticate(workspace)
-        target = self.read_remote(workspace)
-        return self.execute(*self._args(workspace, 'pull', target))
+    def pull(self, workspace, callback=None, timeout=None, **kw):
+        target = self._cached_read_remote(workspace)
+        return self.execute(*self._args(
+            workspace, *self._auth_args(), 'pull',
+            *self._progress_args(callback), target),
+            callback=callback, timeout=timeout)
 
-    def push(self, workspace, **kw):
-        self._authenticate(workspace)
+    def push(self, workspace, callback=None, timeout=None, **kw):
         target = self.get_remote(workspace)
-        return self.execute(*self._args(workspace, 'push', target))
+        return self.execute(*self._args(
+            workspace, *self._auth_args(), 'push',
+            *self._progress_args(callback), target),
+            callback=callback, timeout=timeout)
+
+
+class _SessionRepo(Repo):
+    """
+    A repository kept open for a session, which only reloads its index
+    and configuration when the underlying files have changed.
+    """
+
+    _index = _index_signature = None
+    _config = _config_signature = None
+
+    def open_index(self, *a, **kw):
+        signature = _stat_signature(self.index_path())
+        if self._index is None or signature != self._index_signature:
+            self._index = Repo.open_index(self, *a, **kw)
+            self._index_signature = signature
+        return self._index
+
+    def index_written(self):
+        # The cached index was written by this process, so it remains
+        # identical to what is on the filesystem.
+        if self._index is not None:
+            self._index_signature = _stat_signature(self.index_path())
+
+    def get_config(self):
+        signature = _stat_signature(join(self.commondir(), 'config'))
+        if self._config is None or signature != self._config_signature:
+            self._config = Repo.get_config(self)
+            self._config_signature = signature
+        return self._config
 
 
 class DulwichDvcsCmd(BaseDvcsCmd):
@@ -257,8 +742,40 @@ class DulwichDvcsCmd(BaseDvcsCmd):
     marker = '.git'
 
     default_remote = 'origin'
+    remote_config = 'config'
     _committer = (None, None)
 
+    def __init__(self, remote=None, pool_manager=None, cache_dir=None):
+        """
+        pool_manager
+            A ``urllib3.PoolManager`` used for every HTTP request made
+            by this command, such that connections are reused across
+            operations and workspaces.
+        cache_dir
+            Fetch the objects of the remote into a bare repository
+            within this directory, and clone from it locally, such that
+            repeated clones of a remote only fetch what is new.
+        """
+
+        super(DulwichDvcsCmd, self).__init__(
+            remote=remote, cache_dir=cache_dir)
+        self._pool = pool_manager
+        # The repositories opened by session, keyed by working_dir.
+        self._sessions = {}
+
+    def _get_pool_manager(self):
+        return self._pool
+
+    def _transport_kw(self, location):
+        # Only the HTTP transports accept a pool manager.
+        pool_manager = self._get_pool_manager()
+        if isinstance(location, bytes):
+            location = location.decode('utf8')
+        if pool_manager is None or not location or urlsplit(
+                location).scheme not in ('http', 'https'):
+            return {}
+        return {'pool_manager': pool_manager}
+
     @classmethod
     def available(cls):
         try:
@@ -271,12 +788,167 @@ class DulwichDvcsCmd(BaseDvcsCmd):
     def set_committer(self, name, email, **kw):
         self._committer = (name, email)
 
+    @contextmanager
+    def session(self, workspace):
+        """
+        Keep the repository of workspace open, with its index and
+        configuration loaded, for all operations made on it until the
+        outermost session exits.  Yields the open repository.
+        """
+
+        entry = self._sessions.get(workspace.working_dir)
+        if entry is not None:
+            entry[1] += 1
+        else:
+            entry = self._sessions[workspace.working_dir] = [
+                _SessionRepo(workspace.working_dir), 1]
+        try:
+            yield entry[0]
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._sessions[workspace.working_dir]
+                entry[0].close()
+
+    def _repo(self, workspace):
+        # The repository opened by the session, otherwise the path for
+        # porcelain to open.
+        entry = self._sessions.get(workspace.working_dir)
+        if entry is None:
+            return workspace.working_dir
+        return entry[0]
+
+    def _clone_kw(self, depth=None, branch=None, filter=None, **kw):
+        # single_branch is implied by depth, as dulwich only fetches
+        # the refs that are wanted.
+        clone_kw = {}
+        if depth:
+            clone_kw['depth'] = depth
+        if branch:
+            clone_kw['branch'] = branch
+        if filter:
+            # only supported by the more recent versions of dulwich.
+            clone_kw['filter_spec'] = filter
+        return clone_kw
+
     def clone(self, workspace, **kw):
-        out_stream = BytesIO()
-        err_stream = BytesIO()
-        porcelain.clone(self.remote, workspace.working_dir, outstream=out_stream, errstream=err_stream)
+        """
+        depth
+            Only fetch this many of the latest commits.
+        branch
+            The branch to check out instead of the remote HEAD.
+        filter
+            The partial clone filter, e.g. ``blob:none``, where the
+            installed dulwich supports it.
+        """
+
+        transport_kw = self._transport_kw(self.remote)
+        out_stream, err_stream = _output_streams(kw.get('callback'))
+        clone_kw = self._clone_kw(**kw)
+        # the local transport does not fetch shallow or partial clones.
+        full = 'depth' not in clone_kw and 'filter_spec' not in clone_kw
+        source = local_path(self.remote) if full else None
+        if source is not None and isdir(join(source, self.marker)):
+            source = join(source, self.marker)
+        if source is not None and isdir(join(source, 'objects')):
+            return self._clone_local(
+                source, workspace, clone_kw.get('branch'), err_stream)
+        cache = self._update_cache(err_stream) if full else None
+        if cache is None:
+            porcelain.clone(self.remote, workspace.working_dir, outstream=out_stream, errstream=err_stream,
+                            **dict(clone_kw, **transport_kw))
+        else:
+            porcelain.clone(cache, workspace.working_dir, outstream=out_stream, errstream=err_stream,
+                            **clone_kw)
+            self.write_remote(workspace)
         return out_stream.getvalue(), err_stream.getvalue(), 0
 
+    def _clone_local(self, source, workspace, branch, errstream):
+        # Clone the repository at source, on the local filesystem, by
+        # linking its object store rather than copying the objects one
+        # by one.
+        with Repo(source) as src:
+            heads = src.refs.as_dict(b'refs/heads')
+            tags = src.refs.as_dict(b'refs/tags')
+            head = src.refs.get_symrefs().get(b'HEAD', b'')
+            objects = src.object_store.path
+
+        if not isdir(workspace.working_dir):
+            os.makedirs(workspace.working_dir)
+        with Repo.init(workspace.working_dir) as repo:
+            link_tree(objects, repo.object_store.path)
+
+        if branch:
+            name = branch.encode('utf8')
+        elif head.startswith(b'refs/heads/'):
+            name = head[len(b'refs/heads/'):]
+        else:
+            name = None
+
+        with Repo(workspace.working_dir) as repo:
+            for ref, sha in heads.items():
+                repo.refs[b'refs/remotes/origin/' + ref] = sha
+            for ref, sha in tags.items():
+                repo.refs[b'refs/tags/' + ref] = sha
+            config = repo.get_config()
+            config.set((b'remote', b'origin'), b'url',
+                       self.remote.encode('utf8'))
+            config.set((b'remote', b'origin'), b'fetch',
+                       b'+refs/heads/*:refs/remotes/origin/*')
+            if name in heads:
+                config.set((b'branch', name), b'remote', b'origin')
+                config.set((b'branch', name), b'merge',
+                           b'refs/heads/' + name)
+            config.write_to_path()
+
+            if name is None:
+                return b'', b'', 0
+            if name not in heads:
+                if branch:
+                    errstream.write(b'Remote branch ' + name + b' not found')
+                    return b'', errstream.getvalue(), 1
+                # an empty repository.
+                repo.refs.set_symbolic_ref(b'HEAD', b'refs/heads/' + name)
+                return b'', b'', 0
+            repo.refs[b'refs/heads/' + name] = heads[name]
+            repo.refs.set_symbolic_ref(b'HEAD', b'refs/heads/' + name)
+            porcelain.reset(repo, 'hard', b'HEAD')
+        return b'', errstream.getvalue(), 0
+
+    def _update_cache(self, errstream=None):
+        # Fetch the objects of the remote into the cache, returning its
+        # path, or None if there is no cache to be used.
+        cache = self.cache_path()
+        if cache is None:
+            return None
+        progress = errstream.write if errstream is not None else None
+        with _cache_lock(cache):
+            try:
+                if isdir(cache):
+                    repo = Repo(cache)
+                else:
+                    os.makedirs(cache)
+                    repo = Repo.init_bare(cache)
+                with repo:
+                    client, path = get_transport_and_path(
+                        self.remote, **self._transport_kw(self.remote))
+                    # the refs of the cache are the haves, so only what
+                    # is new gets fetched.
+                    result = client.fetch(path, repo, progress=progress)
+                    for ref, sha in result.refs.items():
+                        if sha and ref.startswith(
+                                (b'refs/heads/', b'refs/tags/')) and \
+                                not ref.endswith(b'^{}'):
+                            repo.refs[ref] = sha
+                    head = result.symrefs.get(b'HEAD')
+                    if head:
+                        repo.refs.set_symbolic_ref(b'HEAD', head)
+            except Exception as e:
+                logger.warning('unable to update the object cache %s: %s',
+                               cache, e)
+                return None
+        return cache
+
     def init_new(self, workspace, **kw):
         # Dulwich.porcelain doesn't re-initialise a repository as true git does.
         if not isdir(join(workspace.working_dir, self.marker)):
@@ -285,38 +957,51 @@ class DulwichDvcsCmd(BaseDvcsCmd):
         return b'', b'', 0 if isdir(join(workspace.working_dir, self.marker)) else 1
 
     def add(self, workspace, path, **kw):
-        rel_paths, ignored = porcelain.add(repo=workspace.working_dir, paths=[path])
+        return self.add_paths(workspace, [path], **kw)
+
+    def add_paths(self, workspace, paths, **kw):
+        paths = list(paths)
+        if not paths:
+            # porcelain.add would otherwise add everything.
+            return b'', b'', 0
+        repo = self._repo(workspace)
+        rel_paths, ignored = porcelain.add(repo=repo, paths=paths)
+        if isinstance(repo, _SessionRepo):
+            repo.index_written()
         return '\n'.join(rel_paths).encode(), '\n'.join(ignored).encode(), 0
 
     def commit(self, workspace, message, **kw):
         output = porcelain.commit(
-            repo=workspace.working_dir, message=message.encode('utf8'),
+            repo=self._repo(workspace), message=message.encode('utf8'),
             committer=f"{self._committer[0]} <{self._committer[1]}>")
         return output, b'', 0 if output else 1
 
     def read_remote(self, workspace, target_remote=None, **kw):
-        with porcelain.open_repo_closing(workspace.working_dir) as repo:
+        with porcelain.open_repo_closing(self._repo(workspace)) as repo:
             _, name = porcelain.get_remote_repo(repo, target_remote)
             return name
 
     def write_remote(self, workspace, target_remote=None, **kw):
         target_remote = target_remote or self.default_remote
+        repo = self._repo(workspace)
         try:
-            porcelain.remote_remove(workspace.working_dir, target_remote.encode())
+            porcelain.remote_remove(repo, target_remote.encode())
         except KeyError:
             pass  # assume the remote wasn't there
-        porcelain.remote_add(workspace.working_dir, target_remote.encode(), self.remote.encode('utf-8'))
+        porcelain.remote_add(repo, target_remote.encode(), self.remote.encode('utf-8'))
+        self._invalidate_remote(workspace)
+        return b'', b'', 0
 
     def pull(self, workspace, username=None, password=None, **kw):
-        out_stream = BytesIO()
-        err_stream = BytesIO()
+        out_stream, err_stream = _output_streams(kw.get('callback'))
         # XXX origin may be undefined
         target = self.get_remote(workspace,
                                  username=username, password=password)
         # XXX assuming repo is clean
         try:
             result = 0
-            porcelain.pull(workspace.working_dir, target.encode(), outstream=out_stream, errstream=err_stream)
+            porcelain.pull(self._repo(workspace), target.encode(), outstream=out_stream, errstream=err_stream,
+                           **self._transport_kw(target))
         except NotGitRepository as e:
             result = 1
             err_stream.write(b'Not a Git repository ' + target.encode())
@@ -324,13 +1009,13 @@ class DulwichDvcsCmd(BaseDvcsCmd):
         return out_stream.getvalue(), err_stream.getvalue(), result
 
     def push(self, workspace, username=None, password=None, branches=None, **kw):
-        outstream = BytesIO()
-        errstream = BytesIO()
+        outstream, errstream = _output_streams(kw.get('callback'))
         push_target = self.get_remote(workspace,
                                       username=username, password=password)
         try:
             # push_target = "file://" + push_target
-            porcelain.push(repo=workspace.working_dir, remote_location=push_target, refspecs=[], outstream=outstream, errstream=errstream)
+            porcelain.push(repo=self._repo(workspace), remote_location=push_target, refspecs=[], outstream=outstream, errstream=errstream,
+                           **self._transport_kw(push_target))
             return_code = 0
         except NotGitRepository as e:
             errstream.write(b'Not a Git repository ' + push_target.encode())
@@ -339,21 +1024,126 @@ class DulwichDvcsCmd(BaseDvcsCmd):
         return outstream.getvalue(), errstream.getvalue(), return_code
 
     def reset_to_remote(self, workspace, branch=None):
+        repo = self._repo(workspace)
         if branch is None:
-            branch = porcelain.active_branch(workspace.working_dir)
+            branch = porcelain.active_branch(repo)
 
         # XXX not actually resetting to remote
-        porcelain.reset(workspace.working_dir, 'hard', treeish=b'HEAD')
+        porcelain.reset(repo, 'hard', treeish=b'HEAD')
         return b'', b'', 0
 
+    def read_file(self, workspace, path, rev=None, **kw):
+        with porcelain.open_repo_closing(self._repo(workspace)) as repo:
+            try:
+                commit = parse_commit(repo, rev or 'HEAD')
+                _, sha = tree_lookup_path(
+                    repo.object_store.__getitem__, commit.tree,
+                    _subpath(workspace, path).encode('utf8'))
+                return repo.object_store[sha].data
+            except (KeyError, NotTreeError):
+                return None
+
+    def status(self, workspace, untracked=True, **kw):
+        with porcelain.open_repo_closing(self._repo(workspace)) as repo:
+            index = repo.open_index()
+            status = {}
+            try:
+                tree = repo[repo.head()].tree
+            except KeyError:
+                tree = None
+            for (old, new), _, _ in index.changes_from_tree(
+                    repo.object_store, tree):
+                if old is None:
+                    status[_decode_path(new)] = 'added'
+                elif new is None:
+                    status[_decode_path(old)] = 'removed'
+                else:
+                    status[_decode_path(new)] = 'modified'
+
+            try:
+                index_mtime = os.stat(repo.index_path()).st_mtime
+            except OSError:
+                index_mtime = 0
+            root = os.fsencode(repo.path)
+            sep = os.sep.encode()
+            for path, entry in index.iteritems():
+                if not hasattr(entry, 'sha'):
+                    # an unmerged path.
+                    status[_decode_path(path)] = 'modified'
+                    continue
+                if stat.S_ISDIR(entry.mode) or stat.S_IFMT(
+                        entry.mode) == _S_IFGITLINK:
+                    continue
+                fs_path = os.path.join(root, path.replace(b'/', sep))
+                try:
+                    st = os.lstat(fs_path)
+                except OSError:
+                    status[_decode_path(path)] = 'missing'
+                    continue
+                if _index_stat_matches(entry, st, index_mtime):
+                    continue
+                # the contents are only read if the size is the same.
+                if (stat.S_ISDIR(st.st_mode) or
+                        entry.size != st.st_size & 0xffffffff or
+                        blob_from_path_and_stat(fs_path, st).id != entry.sha):
+                    status.setdefault(_decode_path(path), 'modified')
+
+            if untracked:
+                for path in porcelain.get_untracked_paths(
+                        repo.path, repo.path, index, exclude_ignored=True):
+                    status[path.replace(os.sep, '/')] = 'untracked'
+        return _sorted_status(status)
+
+
+class _AuthorizedPool(object):
+    # A view of a pool manager not owned by the command, whose headers
+    # carry the authorization of the command, such that it is sent with
+    # each request made by dulwich rather than set on the pool shared
+    # with others.
+
+    def __init__(self, pool_manager, authorization):
+        self.pool_manager = pool_manager
+        self.headers = dict(pool_manager.headers)
+        if authorization is not None:
+            self.headers['Authorization'] = authorization
+
+    def request(self, method, url, headers=None, **kw):
+        if headers is None:
+            headers = self.headers
+        return self.pool_manager.request(method, url, headers=headers, **kw)
+
+    def __getattr__(self, name):
+        return getattr(self.pool_manager, name)
+
 
 class AuthenticatedDulwichDvcsCmd(DulwichDvcsCmd):
     name = 'authenticated_dulwich'
 
-    def __init__(self, remote=None):
-        super().__init__(remote=remote)
+    def __init__(self, remote=None, pool_manager=None, pool_kw=None,
+                 shared_pool=False, cache_dir=None):
+        """
+        pool_manager
+            A ``urllib3.PoolManager`` to use instead of the one created
+            by this command, which may be shared with other commands;
+            the authorization header is sent with each request rather
+            than set on it.
+        pool_kw
+            The keyword arguments for the ``urllib3.PoolManager`` created
+            by this command, e.g. ``maxsize``, ``retries``, ``timeout``
+            or ``block``.  Connections are kept alive in the pool for
+            reuse by subsequent operations until ``close`` is called.
+        shared_pool
+            Use a pool manager shared by all commands within this
+            process that have the same authorization and pool_kw.
+        """
+
+        super().__init__(remote=remote, pool_manager=pool_manager,
+                         cache_dir=cache_dir)
 
         self._auth_header = None
+        self._pool_owned = pool_manager is None
+        self.pool_kw = pool_kw or {}
+        self.shared_pool = shared_pool
 
     def set_authorization(self, authorization_header):
         """
@@ -361,38 +1151,46 @@ class AuthenticatedDulwichDvcsCmd(DulwichDvcsCmd):
         authorization token itself (e.g., "Basic {token}").
         """
         self._auth_header = authorization_header
+        if self._pool is None or not self._pool_owned:
+            return
+        if self.shared_pool:
+            # acquire the shared pool for the new header when next used.
+            self._pool = None
+        else:
+            self._pool.headers['Authorization'] = self._auth_header
 
     def _authenticate_pool_manager(self, *args, **kwargs):
-        pool_manager = urllib3.PoolManager()
+        if self.shared_pool:
+            return shared_pool_manager(self._auth_header, **self.pool_kw)
+        pool_manager = urllib3.PoolManager(**self.pool_kw)
         pool_manager.headers['Authorization'] = self._auth_header
         return pool_manager
 
-    def clone(self, workspace, **kw):
-        pool_manager = self._authenticate_pool_manager()
-        out_stream = BytesIO()
-        err_stream = BytesIO()
-        porcelain.clone(
-            self.remote,
-            workspace.working_dir,
-            pool_manager=pool_manager,
-            outstream=out_stream,
-            errstream=err_stream
-        )
-        return out_stream.getvalue(), err_stream.getvalue(), 0
+    def _get_pool_manager(self):
+        if self._pool is None:
+            self._pool = self._authenticate_pool_manager()
+        elif not self._pool_owned:
+            return _AuthorizedPool(self._pool, self._auth_header)
+        return self._pool
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None and self._pool_owned and not self.shared_pool:
+            pool.clear()
+        self._pool_owned = True
 
     def pull(self, workspace, **kw):
-        pool_manager = self._authenticate_pool_manager()
-        target = self.read_remote(workspace)
-        out_stream = BytesIO()
-        err_stream = BytesIO()
+        target = self._cached_read_remote(workspace)
+        transport_kw = self._transport_kw(target)
+        out_stream, err_stream = _output_streams(kw.get('callback'))
         try:
             result = 0
             porcelain.pull(
-                workspace.working_dir,
+                self._repo(workspace),
                 target.encode(),
-                pool_manager=pool_manager,
                 outstream=out_stream,
-                errstream=err_stream
+                errstream=err_stream,
+                **transport_kw
             )
         except NotGitRepository as e:
             result = 1
@@ -401,18 +1199,17 @@ class AuthenticatedDulwichDvcsCmd(DulwichDvcsCmd):
         return out_stream.getvalue(), err_stream.getvalue(), result
 
     def push(self, workspace, **kw):
-        pool_manager = self._authenticate_pool_manager()
-        target = self.read_remote(workspace)
-        out_stream = BytesIO()
-        err_stream = BytesIO()
+        target = self._cached_read_remote(workspace)
+        transport_kw = self._transport_kw(target)
+        out_stream, err_stream = _output_streams(kw.get('callback'))
         try:
             result = 0
             porcelain.push(
-                workspace.working_dir,
+                self._repo(workspace),
                 target.encode(),
-                pool_manager=pool_manager,
                 outstream=out_stream,
-                errstream=err_stream
+                errstream=err_stream,
+                **transport_kw
             )
         except NotGitRepository as e:
             result = 1
@@ -421,6 +1218,37 @@ class AuthenticatedDulwichDvcsCmd(DulwichDvcsCmd):
         return out_stream.getvalue(), err_stream.getvalue(), result
 
 
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_pool_manager(authorization=None, **pool_kw):
+    """
+    Return the process-wide pool manager for the authorization header
+    and pool_kw, creating it as required.
+    """
+
+    key = (authorization, tuple(sorted(pool_kw.items())))
+    with _shared_pools_lock:
+        pool_manager = _shared_pools.get(key)
+        if pool_manager is None:
+            pool_manager = _shared_pools[key] = urllib3.PoolManager(**pool_kw)
+            pool_manager.headers['Authorization'] = authorization
+        return pool_manager
+
+
+def clear_shared_pools():
+    """
+    Close all connections held by the shared pool managers.
+    """
+
+    with _shared_pools_lock:
+        pools = list(_shared_pools.values())
+        _shared_pools.clear()
+    for pool_manager in pools:
+        pool_manager.clear()
+
+
 def _register():
     register_cmd(MercurialDvcsCmd, DulwichDvcsCmd, GitDvcsCmd, AuthenticatedDulwichDvcsCmd, AuthenticatedGitDvcsCmd)
 
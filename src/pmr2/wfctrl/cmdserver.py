@@ -0,0 +1,160 @@
+"""
+Long-lived processes for executing many commands against a single
+running instance of the external binary, avoiding its startup cost for
+every call.
+"""
+
+import logging
+import struct
+import threading
+from subprocess import Popen, PIPE
+
+from .utils import TIMEOUT_RETURN_CODE
+from .utils import CmdResult
+from .utils import kill_process
+from .utils import popen_kw
+
+logger = logging.getLogger(__name__)
+
+
+class HgCmdServer(object):
+    """
+    Client for the Mercurial command server, which runs any number of
+    commands over the pipe protocol of ``hg serve --cmdserver pipe``.
+
+    The server is started on the first command.
+    """
+
+    def __init__(self, cmd_binary='hg'):
+        self.cmd_binary = cmd_binary
+        self._proc = None
+        self._lock = threading.Lock()
+        self._killed = None
+
+    @property
+    def running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        self._proc = Popen(
+            [self.cmd_binary, 'serve', '--cmdserver', 'pipe'],
+            stdin=PIPE, stdout=PIPE, **popen_kw())
+        channel, data = self._read()
+        if channel != b'o' or b'runcommand' not in data:
+            self.close()
+            raise OSError('unable to start the command server of `%s`' %
+                          self.cmd_binary)
+        logger.debug('started command server: %s', data.splitlines()[-1:])
+
+    def close(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait()
+        except OSError:  # pragma: no cover
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+    def _kill(self, reason):
+        # kill the server, which stops the command currently running
+        # and is restarted for the next.
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return False
+        self._killed = reason
+        kill_process(proc)
+        return True
+
+    def cancel(self):
+        """
+        Kill the server if it is running a command, from any thread.
+        """
+
+        if not self._lock.locked():
+            return False
+        return self._kill('cancelled')
+
+    def _read(self):
+        header = self._proc.stdout.read(5)
+        if len(header) < 5:
+            raise EOFError('command server terminated')
+        channel, length = struct.unpack('>cI', header)
+        if channel.isupper():
+            # input channels only have the length requested.
+            return channel, length
+        return channel, self._proc.stdout.read(length)
+
+    def _write(self, data):
+        self._proc.stdin.write(data)
+        self._proc.stdin.flush()
+
+    def runcommand(self, *args, callback=None, timeout=None):
+        """
+        Run the command, returning (stdout, stderr, return_code) like
+        the direct execution of the binary would.  If callback is
+        provided, the output is passed to it as it arrives instead.
+        If the command exceeds timeout seconds the server is killed.
+        """
+
+        with self._lock:
+            self._killed = None
+            if not self.running:
+                self.start()
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, self._kill, ('timed_out',))
+                timer.daemon = True
+                timer.start()
+            data = b'\0'.join(
+                arg if isinstance(arg, bytes) else arg.encode('utf8')
+                for arg in args)
+            stdout = []
+            stderr = []
+            failed = False
+            try:
+                self._write(b'runcommand\n' + struct.pack('>I', len(data)) +
+                            data)
+                while True:
+                    channel, data = self._read()
+                    if channel in (b'o', b'e') and callback is not None:
+                        callback('stdout' if channel == b'o' else 'stderr',
+                                 data)
+                    elif channel == b'o':
+                        stdout.append(data)
+                    elif channel == b'e':
+                        stderr.append(data)
+                    elif channel == b'r':
+                        return_code = struct.unpack('>i', data)[0]
+                        break
+                    elif channel in (b'I', b'L'):
+                        # no input is ever available, as with the direct
+                        # execution.
+                        self._write(struct.pack('>I', 0))
+                    elif channel.isupper():  # pragma: no cover
+                        raise EOFError('unsupported required channel %r' %
+                                       channel)
+            except (EOFError, OSError) as e:
+                failed = True
+                if not self._killed:
+                    logger.warning('command server failed: %s', e)
+                    stderr.append(('%s\n' % e).encode('utf8'))
+                self.close()
+                return_code = 255
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            # a kill after the command completed does not affect it.
+            killed = self._killed if failed else None
+            self._killed = None
+            if killed == 'timed_out':
+                stderr.append(('killed after exceeding the timeout of %ss\n'
+                               % timeout).encode('utf8'))
+                return_code = TIMEOUT_RETURN_CODE
+            elif killed == 'cancelled':
+                stderr.append(b'cancelled\n')
+            return CmdResult(b''.join(stdout), b''.join(stderr), return_code,
+                             timed_out=killed == 'timed_out',
+                             cancelled=killed == 'cancelled')
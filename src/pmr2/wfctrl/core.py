@@ -1,31 +1,204 @@
 import os
-from os.path import abspath, isabs, isdir, join, normpath, relpath
+from contextlib import contextmanager
+from os.path import abspath, isdir, join, normpath
+import functools
+import glob
+import hashlib
+import json
 import logging
-from subprocess import Popen, PIPE
-
+import threading
+import time
+from shutil import which
+from subprocess import Popen, PIPE, TimeoutExpired
+
+from .instrument import Execution
+from .instrument import Span
+from .instrument import _observers
+from .instrument import notify
+from .utils import TIMEOUT_RETURN_CODE
+from .utils import CmdResult
+from .utils import PathIndex
+from .utils import chunk_args
+from .utils import compile_patterns
+from .utils import kill_process
+from .utils import local_path
+from .utils import redact
+from .utils import popen_kw
 from .utils import set_url_cred
+from .utils import stream_process
 
 logger = logging.getLogger(__name__)
 
 def dummy_action(workspace):
     return
 
-_cmd_classes = {}
-_cmd_names = {}
+def merge_results(results, operation=None):
+    """
+    Merge a sequence of (stdout, stderr, return_code) results into one
+    CmdResult, with the return code being the first non-zero code
+    encountered.  The results merged are kept as its results.
+    """
+
+    stdout = []
+    stderr = []
+    return_code = 0
+    merged = []
+    timed_out = cancelled = False
+    duration = None
+    for result in results:
+        if result is None:
+            continue
+        merged.append(result)
+        out, err, code = result
+        stdout.append(out)
+        stderr.append(err)
+        if code and not return_code:
+            return_code = code
+        timed_out = timed_out or getattr(result, 'timed_out', False)
+        cancelled = cancelled or getattr(result, 'cancelled', False)
+        if getattr(result, 'duration', None) is not None:
+            duration = (duration or 0) + result.duration
+    return CmdResult(b''.join(stdout), b''.join(stderr), return_code,
+                     timed_out=timed_out, cancelled=cancelled,
+                     duration=duration, operation=operation, results=merged)
+
+def _args_max():
+    if os.name == 'nt':  # pragma: no cover
+        # CreateProcess limits the entire command line to 32767
+        # characters.
+        return 32767 // 2
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):  # pragma: no cover
+        limit = -1
+    if limit <= 0:  # pragma: no cover
+        # the POSIX minimum
+        limit = 4096
+    # leave the remainder for the environment.
+    return limit // 2
+
+# The registered command classes, in the order of registration.  Their
+# availability is only determined when a lookup requires it.
+_cmd_classes = []
+_available_cache = {}
+# The binaries located on the path, keyed by the name and the path that
+# was searched, with the resolved location and its stat signature.
+_binary_cache = {}
+# The markers of the workspaces found by discover_workspaces, keyed by
+# their working_dir, such that CmdWorkspace need not probe for them.
+_workspace_markers = {}
 
 def register_cmd(*cmd_classes):
     for cmd_cls in cmd_classes:
-        if not cmd_cls.available():
-            continue
         # The classes passed to register_cmd controls the order of which
-        # the marker gets priority - the first one wins.
-        if cmd_cls.marker not in _cmd_classes:
-            _cmd_classes[cmd_cls.marker] = cmd_cls
-        # The name gets registered regardless.
-        _cmd_names[cmd_cls.name] = cmd_cls
+        # the marker gets priority - the first available one wins.
+        if cmd_cls not in _cmd_classes:
+            _cmd_classes.append(cmd_cls)
+
+def _available_key(cmd_cls):
+    return '%s.%s:%s' % (cmd_cls.__module__, cmd_cls.__name__,
+        getattr(cmd_cls, 'cmd_binary', None) or '')
+
+def cmd_available(cmd_cls):
+    """
+    Report whether the command class is available.  The result is
+    cached for each class and binary combination.
+    """
+
+    key = _available_key(cmd_cls)
+    result = _available_cache.get(key)
+    if result is None:
+        result = _available_cache[key] = bool(cmd_cls.available())
+    return result
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as fd:
+            for block in iter(lambda: fd.read(65536), b''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+# The stat cache entry of a tracked file whose removal was saved.
+_missing = (None, None, None, None)
+
+# Files modified this close to the time their signatures were taken
+# may still be modified within the same timestamp, so they are not
+# trusted as unchanged.
+_racy_ns = 2 * 10 ** 9
+
+# The locks serializing the updates made by this process to each of the
+# object caches, keyed by their path.
+_cache_locks = {}
+_cache_locks_lock = threading.Lock()
+
+@contextmanager
+def _cache_lock(path):
+    with _cache_locks_lock:
+        lock = _cache_locks.setdefault(path, threading.Lock())
+    with lock:
+        yield
+
+def clear_available_cache():
+    _available_cache.clear()
+
+def dump_available_cache(filename):
+    """
+    Write the availability results determined so far to filename, so
+    that they may be loaded by another process.
+    """
+
+    with open(filename, 'w') as fd:
+        json.dump(_available_cache, fd)
+
+def load_available_cache(filename):
+    """
+    Load availability results previously written by
+    dump_available_cache.  A missing or unreadable file is ignored.
+    """
+
+    try:
+        with open(filename) as fd:
+            cache = json.load(fd)
+    except (IOError, OSError, ValueError):
+        logger.debug('unable to load availability cache: %s', filename)
+        return
+    _available_cache.update(
+        (k, bool(v)) for k, v in cache.items() if isinstance(k, str))
 
 def get_cmd_by_name(cmd_name):
-    return _cmd_names.get(cmd_name)
+    # The name gets registered regardless of the order, so the latest
+    # registration that is available wins.
+    for cmd_cls in reversed(_cmd_classes):
+        if getattr(cmd_cls, 'name', None) == cmd_name and cmd_available(
+                cmd_cls):
+            return cmd_cls
+
+def get_cmd_by_marker(marker):
+    for cmd_cls in _cmd_classes:
+        if cmd_cls.marker == marker and cmd_available(cmd_cls):
+            return cmd_cls
+
+def get_cmd_markers():
+    """
+    Return the markers of the registered command classes in the order
+    of their priority.
+    """
+
+    markers = []
+    for cmd_cls in _cmd_classes:
+        if cmd_cls.marker not in markers:
+            markers.append(cmd_cls.marker)
+    return markers
 
 
 class BaseWorkspace(object):
@@ -34,14 +207,37 @@ class BaseWorkspace(object):
     """
 
     marker = None
-    files = None
+    tracked = None
+    # The name of the file inside the marker for the stat cache.
+    stat_cache_name = 'wfctrl-stat.json'
+
+    def __init__(self, working_dir, hash_files=False, **kw):
+        """
+        hash_files
+            Record the content hash of the tracked files in the stat
+            cache, such that files that were touched without their
+            contents being modified are not considered changed.
+        """
 
-    def __init__(self, working_dir, **kw):
         self.working_dir = abspath(normpath(working_dir))
+        self._prefix = join(self.working_dir, '')
+        self.hash_files = hash_files
+        self._stat_cache = None
+        self._stat_pending = {}
         self.reset()
 
     def reset(self):
-        self.files = set()
+        # The tracked files, by their path relative to working_dir.
+        self.tracked = PathIndex()
+        self._tracked_view = None
+
+    @property
+    def files(self):
+        """
+        The set of the absolute paths of the tracked files.
+        """
+
+        return set(self._prefix + path for path in self.tracked)
 
     def initialize(self, **kw):
         # Unused here.
@@ -51,23 +247,235 @@ class BaseWorkspace(object):
         # Unused here.
         raise NotImplementedError
 
+    def _subpath(self, filename):
+        # The path of filename relative to working_dir, where relative
+        # filenames are taken to be relative to working_dir already.
+        path = normpath(join(self.working_dir, filename))
+        if not path.startswith(self._prefix):
+            raise ValueError('filename not inside working dir')
+        return path[len(self._prefix):]
+
     def add_file(self, filename):
         """
         Add a file.  Should be relative to the root of the working_dir.
         """
 
-        if not isabs(filename):
-            # Normalize a relative path into absolute path based inside
-            # the workspace working dir.
-            filename = abspath(normpath(join(self.working_dir, filename)))
+        self.tracked.add(self._subpath(filename))
 
-        if not filename.startswith(self.working_dir):
-            raise ValueError('filename not inside working dir')
+    def add_files(self, filenames):
+        """
+        Add the files in the iterable filenames.  No file is added if
+        any of them is not inside the working_dir.
+        """
+
+        self.tracked.update([self._subpath(f) for f in filenames])
+
+    def add_dir(self, path='', recursive=True, include=None, exclude=None):
+        """
+        Add the files within the directory path, relative to the root
+        of the working_dir by default, and return the number of files
+        found.  The marker directory and symlinked directories are not
+        descended into.
+
+        recursive
+            Add the files within the subdirectories too.
+        include
+            The glob pattern, or list of them, that the files must
+            match to be added.  Like gitignore, a pattern without a
+            ``/`` is matched against the name of the file, otherwise
+            against its path relative to the working_dir.
+        exclude
+            The glob patterns of the files to leave out, and of the
+            directories not to descend into, matched likewise.
+        """
+
+        include = compile_patterns(include)
+        exclude = compile_patterns(exclude)
+        top = ''
+        if normpath(join(self.working_dir, path)) != self.working_dir:
+            top = self._subpath(path)
+        found = []
+        stack = [top]
+        while stack:
+            subdir = stack.pop()
+            root = join(self.working_dir, subdir)
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.name == self.marker:
+                        continue
+                    subpath = join(subdir, entry.name)
+                    key = subpath.replace(os.sep, '/')
+                    if exclude and exclude(key):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(subpath)
+                    elif include is None or include(key):
+                        found.append(subpath)
+        self.tracked.update(found)
+        return len(found)
+
+    def add_glob(self, pattern, exclude=None):
+        """
+        Add the files matching the glob pattern, relative to the root
+        of the working_dir, where ``**`` matches any number of
+        directories, and return the number of files found.
+
+        exclude
+            As for add_dir.
+        """
+
+        exclude = compile_patterns(exclude)
+        found = []
+        for filename in glob.iglob(
+                join(glob.escape(self.working_dir), pattern), recursive=True):
+            subpath = self._subpath(filename)
+            parts = subpath.split(os.sep)
+            if isdir(filename) or self.marker in parts:
+                continue
+            # the files within the excluded directories are excluded.
+            if exclude and any(exclude('/'.join(parts[:i]))
+                               for i in range(1, len(parts) + 1)):
+                continue
+            found.append(subpath)
+        self.tracked.update(found)
+        return len(found)
+
+    def _get_tracked_view(self):
+        # The sorted tuple of the absolute paths of the tracked files,
+        # kept until the index changes.
+        version = self.tracked.version
+        if self._tracked_view is None or self._tracked_view[0] != version:
+            self._tracked_view = (version, tuple(
+                self._prefix + path for path in self.tracked))
+        return self._tracked_view[1]
+
+    def iter_tracked_subpaths(self, relative=False):
+        """
+        Iterate over the tracked files in order, without building a
+        list of them.
 
-        self.files.add(filename)
+        relative
+            Provide the paths relative to the working_dir, with the
+            ``/`` separator as used by the repositories, rather than
+            the absolute paths.
+        """
 
-    def get_tracked_subpaths(self):
-        return sorted(list(self.files))
+        if not relative:
+            return iter(self._get_tracked_view())
+        if os.sep == '/':
+            return iter(self.tracked)
+        return (path.replace(os.sep, '/') for path in self.tracked)
+
+    def get_tracked_subpaths(self, relative=False):
+        """
+        Return the tracked files as a sorted list, as for
+        iter_tracked_subpaths.
+        """
+
+        return list(self.iter_tracked_subpaths(relative=relative))
+
+    def _stat_cache_path(self):
+        if self.marker:
+            return join(self.working_dir, self.marker, self.stat_cache_name)
+
+    def load_stat_cache(self):
+        """
+        Return the stat cache, a mapping of the subpaths of the tracked
+        files to their (mtime_ns, size, inode, hash) as of the last
+        save, all None for those whose removal was saved, loading it
+        from the marker on first access.
+        """
+
+        if self._stat_cache is not None:
+            return self._stat_cache
+        self._stat_cache = {}
+        path = self._stat_cache_path()
+        if path is None:
+            return self._stat_cache
+        try:
+            with open(path) as fd:
+                cache = json.load(fd)
+        except (IOError, OSError, ValueError):
+            logger.debug('unable to load stat cache: %s', path)
+            return self._stat_cache
+        if isinstance(cache, dict):
+            self._stat_cache.update(
+                (k, tuple(v)) for k, v in cache.items()
+                if isinstance(v, list) and len(v) == 4)
+        return self._stat_cache
+
+    def write_stat_cache(self):
+        path = self._stat_cache_path()
+        if path is None or not isdir(os.path.dirname(path)):
+            return
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w') as fd:
+                json.dump(self.load_stat_cache(), fd)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            logger.warning('unable to write stat cache: %s', path)
+
+    def clear_stat_cache(self):
+        """
+        Discard the stat cache, such that every tracked file is
+        considered changed.
+        """
+
+        self._stat_cache = {}
+        self._stat_pending = {}
+        path = self._stat_cache_path()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def get_changed_subpaths(self):
+        """
+        Return the tracked files that are new or were modified since
+        the last call to update_stat_cache, as a sorted list.
+        """
+
+        cache = self.load_stat_cache()
+        threshold = time.time_ns() - _racy_ns
+        self._stat_pending = {}
+        changed = []
+        for path, filename in zip(self.tracked, self._get_tracked_view()):
+            key = path.replace('\\', '/')
+            signature = _stat_signature(filename)
+            entry = cache.get(key)
+            if signature is None:
+                if entry == _missing:
+                    continue
+                self._stat_pending[key] = _missing
+            elif signature[0] < threshold:
+                if entry is not None and entry[:3] == signature:
+                    continue
+                digest = None
+                if self.hash_files:
+                    digest = _file_hash(filename)
+                    if entry is not None and digest and entry[3] == digest:
+                        # only touched, so just refresh the signature.
+                        cache[key] = signature + (digest,)
+                        continue
+                self._stat_pending[key] = signature + (digest,)
+            changed.append(filename)
+        return changed
+
+    def update_stat_cache(self):
+        """
+        Record the signatures taken by the last get_changed_subpaths
+        as saved, dropping the files no longer tracked, and persist
+        the stat cache.
+        """
+
+        cache = self.load_stat_cache()
+        cache.update(self._stat_pending)
+        self._stat_pending = {}
+        tracked = set(path.replace('\\', '/') for path in self.tracked)
+        for key in list(cache):
+            if key not in tracked:
+                del cache[key]
+        self.write_stat_cache()
 
     def save(self, **kw):
         raise NotImplementedError
@@ -89,26 +497,52 @@ class CmdWorkspace(BaseWorkspace):
     Default workspace, file based.
     """
 
-    def __init__(self, working_dir, cmd=None, auto=False, **kw):
+    def __init__(self, working_dir, cmd=None, auto=False, depth=None,
+                 branch=None, single_branch=None, filter=None, **kw):
         """
         marker
             The marker path that denotes that this was already
             initialized.
         cmd
             A command object
+        depth, branch, single_branch, filter
+            Passed to the clone made by the command when initializing
+            from a remote; see the clone of the command for the ones
+            it supports.
         """
 
-        BaseWorkspace.__init__(self, working_dir)
+        BaseWorkspace.__init__(self, working_dir, **kw)
+        self.clone_kw = dict((k, v) for k, v in (
+            ('depth', depth), ('branch', branch),
+            ('single_branch', single_branch), ('filter', filter),
+        ) if v is not None)
+        detected = None
         if auto:
-            for marker, cls in _cmd_classes.items():
-                target = abspath(normpath(join(self.working_dir, marker)))
-                if not isdir(target):
-                    continue
-                cmd = cls()
-                break
+            detected = self._detect_cmd_cls()
+            if detected is not None:
+                cmd = detected()
         self.cmd = cmd
         self.update_cmd_table(cmd)
-        self.initialize()
+        if detected is not None:
+            # its marker was found, so there is nothing to initialize.
+            logger.debug('already initialized: %s', self.working_dir)
+        else:
+            self.initialize()
+
+    def _detect_cmd_cls(self):
+        # The command class for the marker within working_dir, as
+        # recorded by discover_workspaces or otherwise found on disk.
+        marker = _workspace_markers.get(self.working_dir)
+        if marker is not None:
+            cls = get_cmd_by_marker(marker)
+            if cls is not None:
+                return cls
+        for marker in get_cmd_markers():
+            if not isdir(join(self.working_dir, marker)):
+                continue
+            cls = get_cmd_by_marker(marker)
+            if cls is not None:
+                return cls
 
     def update_cmd_table(self, cmd):
         self.cmd_table = {}
@@ -137,7 +571,7 @@ class CmdWorkspace(BaseWorkspace):
         if self.check_marker():
             logger.debug('already initialized: %s', self.working_dir)
             return
-        return self.get_cmd('init')(self, **kw)
+        return self.get_cmd('init')(self, **dict(self.clone_kw, **kw))
 
     def save(self, **kw):
         """
@@ -146,6 +580,147 @@ class CmdWorkspace(BaseWorkspace):
 
         return self.get_cmd('save')(self, **kw)
 
+    def status(self, untracked=True):
+        """
+        Return the changes within this workspace from its current
+        revision, as a dict of their paths to their states; see the
+        status of the command.  Returns None without a command.
+        """
+
+        if self.cmd is None:
+            return None
+        return self.cmd.status(self, untracked=untracked)
+
+    def changed_files(self, untracked=True):
+        """
+        Return the absolute paths of the files with changes within this
+        workspace from its current revision, including the ones that
+        are missing, as a sorted list, or None if they could not be
+        determined.
+        """
+
+        status = self.status(untracked=untracked)
+        if status is None:
+            return None
+        return [self._prefix + path.replace('/', os.sep) for path in status]
+
+    @contextmanager
+    def session(self):
+        """
+        Context manager for a sequence of operations on this workspace,
+        for which the command may keep its state (such as an open
+        repository) rather than reloading it for every operation.
+        Yields the object provided by the command, if any.
+        """
+
+        session = getattr(self.cmd, 'session', None)
+        if session is None:
+            yield None
+            return
+        with session(self) as handle:
+            yield handle
+
+
+# The spans in progress within the current thread, and whether an
+# execution is being recorded (so the executions made through super
+# are not recorded again).
+_instrument_state = threading.local()
+
+def _span_stack():
+    stack = getattr(_instrument_state, 'spans', None)
+    if stack is None:
+        stack = _instrument_state.spans = []
+    return stack
+
+def _op_result(name, result, start):
+    # the (stdout, stderr, return_code) results of the operations as a
+    # CmdResult noting the operation that returned it.
+    if not isinstance(result, tuple) or len(result) != 3:
+        return result
+    if not isinstance(result, CmdResult):
+        result = CmdResult(*result)
+    result.operation = name
+    result.duration = time.perf_counter() - start
+    return result
+
+def _instrument_op(name, f):
+    @functools.wraps(f)
+    def wrapper(self, *a, **kw):
+        start = time.perf_counter()
+        observers = self._get_observers()
+        stack = _span_stack()
+        if not observers or (stack and stack[-1].name == name and
+                             stack[-1].cmd_name == self.name):
+            # also when the operation is calling its super.
+            return _op_result(name, f(self, *a, **kw), start)
+        workspace = a[0] if a else kw.get('workspace')
+        parent = stack[-1] if stack else None
+        span = Span(name, self.name, getattr(workspace, 'working_dir', None),
+                    parent)
+        if parent is not None:
+            parent.children.append(span)
+        stack.append(span)
+        notify(observers, 'span_started', span)
+        error = None
+        try:
+            return _op_result(name, f(self, *a, **kw), start)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            stack.pop()
+            span.finish(error)
+            notify(observers, 'span_finished', span)
+    wrapper._instrumented = True
+    return wrapper
+
+def _instrument_execute(f):
+    @functools.wraps(f)
+    def wrapper(self, *args, **kw):
+        observers = self._get_observers()
+        if not observers or getattr(_instrument_state, 'executing', False):
+            return f(self, *args, **kw)
+        counts = [0, 0]
+        callback = kw.get('callback')
+        if callback is not None:
+            def counting(name, chunk):
+                counts[name == 'stderr'] += len(chunk)
+                return callback(name, chunk)
+            kw['callback'] = counting
+        _instrument_state.executing = True
+        start = time.perf_counter()
+        try:
+            result = f(self, *args, **kw)
+        finally:
+            _instrument_state.executing = False
+        elapsed = time.perf_counter() - start
+        stdout, stderr, return_code = result
+        stack = _span_stack()
+        span = stack[-1] if stack else None
+        argv = [getattr(self, 'cmd_binary', None) or self.name]
+        argv.extend(args)
+        execution = Execution(
+            [redact(str(arg)) for arg in argv], elapsed,
+            len(stdout or b'') + counts[0], len(stderr or b'') + counts[1],
+            return_code, span)
+        if span is not None:
+            span.executions.append(execution)
+        notify(observers, 'executed', execution)
+        return result
+    wrapper._instrumented = True
+    return wrapper
+
+def _instrument_class(cls):
+    # wrap the operations defined by cls, such that the overrides made
+    # by every backend are instrumented.
+    for name in cls.instrumented_ops:
+        f = cls.__dict__.get(name)
+        if callable(f) and not hasattr(f, '_instrumented'):
+            setattr(cls, name, _instrument_op(name, f))
+    f = cls.__dict__.get('execute')
+    if callable(f) and not hasattr(f, '_instrumented'):
+        setattr(cls, 'execute', _instrument_execute(f))
+
 
 class BaseCmd(object):
     """
@@ -181,9 +756,69 @@ class BaseDvcsCmd(BaseCmd):
     name = '__base__'
     default_remote = None
     auto_push = True
-
-    def __init__(self, remote=None):
+    # The configuration file inside the marker that stores the remotes,
+    # used for caching the results of read_remote.
+    remote_config = None
+    _remote_cache = None
+    # The directory holding the local caches of the objects of the
+    # remotes, shared by the clones made by commands using it.
+    cache_dir = None
+    # The operations reported to the observers as spans; see the
+    # instrument module.
+    instrumented_ops = ('init', 'save', 'clone', 'init_new', 'add',
+                        'add_paths', 'commit', 'read_remote', 'write_remote',
+                        'update_remote', 'pull', 'push', 'reset_to_remote',
+                        'read_file', 'status')
+    # Unset for the copies that only plan the commands to execute.
+    instrumented = True
+    observers = ()
+
+    def __init__(self, remote=None, cache_dir=None):
         self.remote = remote
+        if cache_dir:
+            self.cache_dir = cache_dir
+
+    def __init_subclass__(cls, **kw):
+        super(BaseDvcsCmd, cls).__init_subclass__(**kw)
+        _instrument_class(cls)
+
+    def add_observer(self, observer):
+        """
+        Notify observer of the operations of this command and the
+        external commands they execute.
+        """
+
+        self.observers = tuple(self.observers) + (observer,)
+
+    def remove_observer(self, observer):
+        self.observers = tuple(o for o in self.observers if o is not observer)
+
+    def _get_observers(self):
+        if not self.instrumented:
+            return ()
+        if _observers:
+            return tuple(_observers) + tuple(self.observers)
+        return self.observers
+
+    def cache_path(self, remote=None):
+        """
+        Return the path of the object cache for remote (the remote of
+        this command by default) within cache_dir, or None without a
+        cache_dir.  The credentials within remote are not part of the
+        key, so they are shared by the clones made by all users.
+
+        Remotes on the local filesystem are cloned from directly, so
+        they have no cache.
+        """
+
+        remote = remote or self.remote
+        if not self.cache_dir or not remote or local_path(remote):
+            return None
+        key = hashlib.sha1(set_url_cred(remote).encode('utf8')).hexdigest()
+        # named by the marker, such that commands using the same format
+        # of repository share the caches.
+        prefix = (self.marker or '').strip('.') or self.name
+        return join(self.cache_dir, '%s-%s' % (prefix, key))
 
     def clone(self, workspace, **kw):
         raise NotImplementedError
@@ -194,6 +829,16 @@ class BaseDvcsCmd(BaseCmd):
     def add(self, workspace, path, **kw):
         raise NotImplementedError
 
+    def add_paths(self, workspace, paths, **kw):
+        """
+        Add multiple paths.  Backends that can stage many paths with a
+        single call should override this, as the default simply calls
+        add for every path.
+        """
+
+        return merge_results(
+            [self.add(workspace, path, **kw) for path in paths])
+
     def commit(self, workspace, message, **kw):
         raise NotImplementedError
 
@@ -222,25 +867,128 @@ class BaseDvcsCmd(BaseCmd):
     def reset_to_remote(self, workspace, **kw):
         raise NotImplementedError
 
+    def read_file(self, workspace, path, rev=None, **kw):
+        """
+        Return the contents of path as committed at rev, which defaults
+        to the current revision, or None if it was not found.
+        """
+
+        raise NotImplementedError
+
+    def status(self, workspace, untracked=True, **kw):
+        """
+        Return the changes within the working tree of workspace from
+        the current revision, as a dict of the path of every changed
+        file, relative to the root of the workspace with the ``/``
+        separator, to its state, in the order of the paths, or None if
+        they could not be determined.  The states are:
+
+        added
+            Added to the index, or renamed from another path.
+        modified
+            The contents, staged or not, differ.
+        removed
+            Removed from the index, or renamed to another path.
+        missing
+            Deleted from the working tree without being removed.
+        untracked
+            Not in the index, and not ignored, if untracked is set.
+        """
+
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by this command, such as persistent
+        processes or connections.
+        """
+
+    @contextmanager
+    def session(self, workspace):
+        """
+        Context manager for a sequence of operations on workspace.
+        Backends that can keep the repository open between operations
+        should override this and yield the open repository.
+        """
+
+        yield None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def init(self, workspace, **kw):
         if self.remote:
-            self.clone(workspace)
+            return self.clone(workspace, **kw)
         else:
-            self.init_new(workspace)
+            return self.init_new(workspace)
 
     def save(self, workspace, message='', **kw):
-        for path in workspace.get_tracked_subpaths():
-            logger.debug('Add path={0}'.format(path))
-            self.add(workspace, path)
-        # XXX return these results.
-        self.commit(workspace, message)
-        self.update_remote(workspace)
-        self.push(workspace)
+        """
+        Commit the changed files of workspace and push them, returning
+        a CmdResult merging the results of the steps taken, which are
+        available as its results.
+        """
+
+        paths = workspace.get_changed_subpaths()
+        logger.debug('Add paths count={0}'.format(len(paths)))
+        results = []
+        with self.session(workspace):
+            if paths:
+                added = self.add_paths(workspace, paths)
+                commit = self.commit(workspace, message)
+                results.extend([added, commit])
+                # the files of a failed add may not have been staged,
+                # so they are left to be added again on the next save.
+                if not merge_results([added, commit])[2]:
+                    workspace.update_stat_cache()
+            else:
+                logger.debug('no changed paths, not committing')
+            results.append(self.update_remote(workspace))
+            results.append(self.push(workspace))
+        return merge_results(results)
+
+    def _remote_config_path(self, workspace):
+        if self.marker and self.remote_config:
+            return join(workspace.working_dir, self.marker, self.remote_config)
+
+    def _cached_read_remote(self, workspace, target_remote=None):
+        """
+        Return the result of read_remote, cached for the workspace
+        until write_remote is called or the configuration file
+        is modified.
+        """
+
+        target_remote = target_remote or self.default_remote
+        config = self._remote_config_path(workspace)
+        if config is None:
+            return self.read_remote(workspace, target_remote=target_remote)
+
+        if self._remote_cache is None:
+            self._remote_cache = {}
+        key = (config, target_remote)
+        signature = _stat_signature(config)
+        entry = self._remote_cache.get(key)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        result = self.read_remote(workspace, target_remote=target_remote)
+        self._remote_cache[key] = (signature, result)
+        return result
+
+    def _invalidate_remote(self, workspace):
+        config = self._remote_config_path(workspace)
+        if self._remote_cache and config:
+            for key in list(self._remote_cache):
+                if key[0] == config:
+                    del self._remote_cache[key]
 
     def get_remote(self, workspace,
                    target_remote=None, username=None, password=None):
         target_remote = target_remote or self.default_remote
-        target_url = self.read_remote(workspace, target_remote=target_remote)
+        target_url = self._cached_read_remote(
+            workspace, target_remote=target_remote)
         if target_url is None:
             # XXX should we inform caller here that it's undefined?
             return set_url_cred(target_remote, username, password)
@@ -248,24 +996,58 @@ class BaseDvcsCmd(BaseCmd):
 
     def update_remote(self, workspace):
         default_origin = self.default_remote
-        stored_remote = self.read_remote(workspace)
+        stored_remote = self._cached_read_remote(workspace)
 
         if stored_remote and self.remote:
             if self.remote == stored_remote:
                 logger.debug('remotes matched, not issuing update command')
                 return
             logger.info('updating stored remote with current remote')
-            self.write_remote(workspace)
+            return self.write_remote(workspace)
         elif self.remote is None and stored_remote is None:
             logger.warning('no default remote define, push will fail')
         elif self.remote and stored_remote is None:
             logger.info('writing current remote in cmd object')
-            self.write_remote(workspace)
+            return self.write_remote(workspace)
         elif self.remote is None and stored_remote:
             logger.debug('using stored remote')
             self.remote = stored_remote
 
 
+_instrument_class(BaseDvcsCmd)
+
+
+class _Processes(object):
+    # The processes being executed for a command, such that they may be
+    # cancelled from another thread.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = set()
+        self._cancelled = set()
+
+    def add(self, proc):
+        with self._lock:
+            self._running.add(proc)
+
+    def discard(self, proc):
+        # return whether the process was cancelled.
+        with self._lock:
+            self._running.discard(proc)
+            if proc in self._cancelled:
+                self._cancelled.discard(proc)
+                return True
+        return False
+
+    def cancel(self):
+        with self._lock:
+            procs = list(self._running)
+            self._cancelled.update(procs)
+        for proc in procs:
+            kill_process(proc)
+        return len(procs)
+
+
 class BaseDvcsCmdBin(BaseDvcsCmd):
     """
     Base DVCS binaries based command.
@@ -273,19 +1055,44 @@ class BaseDvcsCmdBin(BaseDvcsCmd):
 
     name = '__base_bin__'
     cmd_binary = None
-
-    def __init__(self, remote=None, cmd_binary=None):
-        super(BaseDvcsCmdBin, self).__init__(remote=remote)
+    # The space available for arguments on a single command line.
+    args_max = _args_max()
+    # The default number of seconds an execution may take before it is
+    # killed, None for no limit.
+    timeout = None
+    _processes = None
+    # The attributes holding the processes of this object, which are
+    # left behind when it is pickled (e.g. for a ProcessPoolExecutor)
+    # and return to their class defaults.
+    _process_attrs = ('_processes',)
+
+    def __init__(self, remote=None, cmd_binary=None, timeout=None,
+                 cache_dir=None):
+        super(BaseDvcsCmdBin, self).__init__(
+            remote=remote, cache_dir=cache_dir)
         if cmd_binary:
             self.cmd_binary = cmd_binary
+        if timeout is not None:
+            self.timeout = timeout
         if not self._available():
             raise ValueError('the %s cmd_binary `%s` is not available' % 
                 (self.name, cmd_binary))
+        self._processes = _Processes()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._process_attrs:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     # class method private because this is used only with the class
     # version of the available.
     @classmethod
-    def _execute(cls, args=None, cmd_binary=None):
+    def _execute(cls, args=None, cmd_binary=None, callback=None,
+                 timeout=None, processes=None):
         if not cmd_binary:
             cmd_binary = cls.cmd_binary
         if not args:
@@ -293,16 +1100,42 @@ class BaseDvcsCmdBin(BaseDvcsCmd):
         cmdargs = [cmd_binary]
         cmdargs.extend(args)
 
-        extra_kw = {}
-
-        if os.name == 'posix':
-            # What this does is to prevent subprocesses from opening
-            # pty/tty for further user input/output.
-            # Still need to determine whether this is needed on Windows.
-            extra_kw['preexec_fn'] = os.setsid
-
-        p = Popen(cmdargs, stdin=PIPE, stdout=PIPE, stderr=PIPE, **extra_kw)
-        return p.communicate() + (p.returncode,)
+        start = time.perf_counter()
+        p = Popen(cmdargs, stdin=PIPE, stdout=PIPE, stderr=PIPE, **popen_kw())
+        if processes is not None:
+            processes.add(p)
+        stdout = stderr = b''
+        timed_out = cancelled = False
+        try:
+            if callback is not None:
+                return_code = stream_process(p, callback, timeout=timeout)
+            else:
+                stdout, stderr = p.communicate(timeout=timeout)
+                return_code = p.returncode
+        except TimeoutExpired:
+            # the process group, as git leaves its helpers running.
+            kill_process(p)
+            if callback is None:
+                stdout, stderr = p.communicate()
+            p.wait()
+            timed_out = True
+        finally:
+            if processes is not None:
+                cancelled = processes.discard(p)
+
+        if timed_out:
+            # only the binary is logged, as the arguments may contain
+            # credentials.
+            logger.warning('`%s` killed after exceeding the timeout of %ss',
+                           cmd_binary, timeout)
+            stderr += ('killed after exceeding the timeout of %ss\n' %
+                       timeout).encode('utf8')
+            return_code = TIMEOUT_RETURN_CODE
+        elif cancelled:
+            stderr += b'cancelled\n'
+        return CmdResult(stdout, stderr, return_code, timed_out=timed_out,
+                         cancelled=cancelled,
+                         duration=time.perf_counter() - start, argv=cmdargs)
 
     # public class method because this is useful before class is
     # instantiated.
@@ -310,28 +1143,95 @@ class BaseDvcsCmdBin(BaseDvcsCmd):
     def available(cls, cmd_binary=None):
         """
         Class method that reports whether the command binary is
-        available.
+        available.  The binary is located on the path without being
+        executed.
         """
 
         if cmd_binary is None:
             cmd_binary = cls.cmd_binary
         if not cmd_binary:
             return False
-        try:
-            cls._execute(cmd_binary=cmd_binary)
-        except OSError:
-            return False
-        return True
+        return cls._locate(cmd_binary) is not None
+
+    @classmethod
+    def _locate(cls, cmd_binary):
+        key = (cmd_binary, os.environ.get('PATH'))
+        entry = _binary_cache.get(key)
+        if entry is not None:
+            location, signature = entry
+            if _stat_signature(location) == signature:
+                return location
+        location = which(cmd_binary)
+        if location is None:
+            # not cached, so a later installation is picked up.
+            _binary_cache.pop(key, None)
+            return None
+        _binary_cache[key] = (location, _stat_signature(location))
+        return location
+
+    @classmethod
+    def invalidate_available(cls, cmd_binary=None):
+        """
+        Discard the cached locations of cmd_binary, or of all binaries
+        if not specified, along with the cached availability of the
+        registered command classes.
+        """
+
+        for key in list(_binary_cache):
+            if cmd_binary is None or key[0] == cmd_binary:
+                del _binary_cache[key]
+        clear_available_cache()
 
     # private as instance method because only startup needs this
     def _available(self):
         return self.available(cmd_binary=self.cmd_binary)
 
+    def _get_processes(self):
+        if self._processes is None:
+            self._processes = _Processes()
+        return self._processes
+
+    def cancel(self):
+        """
+        Kill the commands currently being executed by this object,
+        which may be called from any thread.  Their results will be
+        marked as cancelled.  Returns the number of commands killed.
+        """
+
+        return self._get_processes().cancel()
+
     # public instance method because instances always execute this.
-    def execute(self, *args):
+    def execute(self, *args, callback=None, timeout=None):
+        """
+        Executes an external command, returning a CmdResult.
+
+        callback
+            If provided, the output is passed to it as it arrives, as
+            callback('stdout', chunk) or callback('stderr', chunk),
+            rather than being collected and returned.
+        timeout
+            The number of seconds the command may take before it and
+            the processes it started are killed, with the result marked
+            as timed_out.  Defaults to the timeout of this object.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        return self._execute(args=args, cmd_binary=self.cmd_binary,
+                             callback=callback, timeout=timeout,
+                             processes=self._get_processes())
+
+    def execute_chunked(self, args, paths):
         """
-        Executes an external command.
+        Executes an external command with the args followed by the
+        paths, splitting the paths across as many invocations as
+        required to stay within the command line limit.
         """
 
-        return self._execute(args=args, cmd_binary=self.cmd_binary)
+        limit = self.args_max - sum(len(arg) + 1 for arg in args) - len(
+            self.cmd_binary) - 1
+        return merge_results([
+            self.execute(*(list(args) + chunk))
+            for chunk in chunk_args(paths, limit)
+        ])
 
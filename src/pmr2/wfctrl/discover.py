@@ -0,0 +1,128 @@
+"""
+Discovering the workspaces within a directory tree.
+"""
+
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from os.path import abspath, join, normpath
+
+from . import core
+from .core import get_cmd_by_marker
+from .core import get_cmd_markers
+
+logger = logging.getLogger(__name__)
+
+
+def scan_dir(path, markers):
+    """
+    Scan the directory path once, returning the first of the markers
+    it contains, in the order given, or None along with the list of its
+    subdirectories.  Symlinked directories are not included.
+    """
+
+    found = set()
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                except OSError:
+                    continue
+                if entry.name in markers:
+                    found.add(entry.name)
+                else:
+                    subdirs.append(entry.name)
+    except OSError as e:
+        logger.debug('unable to scan %s: %s', path, e)
+        return None, []
+    for marker in markers:
+        if marker in found:
+            return marker, []
+    return None, subdirs
+
+
+def discover_workspaces(root, max_workers=4, executor=None, max_depth=None,
+                        cache=True):
+    """
+    Walk the directory tree at root, scanning each directory once, and
+    return a dict of the working_dir of every workspace found to its
+    command class, in the order of the working_dir.  The workspaces are
+    not descended into.
+
+    max_workers
+        The number of threads scanning directories at once, which
+        helps on network filesystems; 1 scans within this thread.
+    executor
+        A ``concurrent.futures`` executor to use instead of the
+        default thread pool.
+    max_depth
+        The number of levels below root to descend at most, with 0
+        only considering root itself.
+    cache
+        Record the workspaces found, replacing those recorded under
+        root before, such that a CmdWorkspace constructed with
+        ``auto`` for any of them does not probe for its marker.
+    """
+
+    root = abspath(normpath(root))
+    # only the markers of the available commands, in their priority.
+    markers = [marker for marker in get_cmd_markers()
+               if get_cmd_by_marker(marker) is not None]
+    found = {}
+    pending = [(root, 0)]
+
+    def scanned(path, depth, result):
+        marker, subdirs = result
+        if marker is not None:
+            found[path] = marker
+        elif max_depth is None or depth < max_depth:
+            pending.extend((join(path, name), depth + 1) for name in subdirs)
+
+    owned = executor is None and max_workers > 1
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        if executor is None:
+            while pending:
+                path, depth = pending.pop()
+                scanned(path, depth, scan_dir(path, markers))
+        else:
+            running = {}
+            while pending or running:
+                while pending:
+                    path, depth = pending.pop()
+                    future = executor.submit(scan_dir, path, markers)
+                    running[future] = (path, depth)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = running.pop(future)
+                    scanned(path, depth, future.result())
+    finally:
+        if owned:
+            executor.shutdown(wait=True)
+
+    if cache:
+        forget_workspaces(root)
+        core._workspace_markers.update(found)
+    return dict((path, get_cmd_by_marker(found[path]))
+                for path in sorted(found))
+
+
+def forget_workspaces(root=None):
+    """
+    Discard the recorded workspaces within root, or all of them.
+    """
+
+    if root is None:
+        core._workspace_markers.clear()
+        return
+    root = abspath(normpath(root))
+    prefix = join(root, '')
+    for path in list(core._workspace_markers):
+        if path == root or path.startswith(prefix):
+            del core._workspace_markers[path]
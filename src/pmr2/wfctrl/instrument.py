@@ -0,0 +1,195 @@
+"""
+Instrumentation of the operations of the commands.
+
+Observers registered on a command (through ``add_observer``), or for
+every command (through ``register_observer``), are notified as each
+high-level operation (e.g. save, add_paths, push) starts and finishes
+as a Span, nested within the operation that invoked it, and of every
+external command executed as an Execution.  Commands without observers
+are not instrumented beyond checking for them.
+"""
+
+import logging
+import threading
+import time
+
+from .utils import redact
+
+logger = logging.getLogger(__name__)
+
+# The observers notified for every command.
+_observers = []
+
+
+def register_observer(observer):
+    """
+    Register observer to be notified of the operations of all commands
+    within this process.
+    """
+
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def unregister_observer(observer):
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+class Span(object):
+    """
+    A high-level operation of a command.
+    """
+
+    def __init__(self, name, cmd_name, working_dir=None, parent=None):
+        self.name = name
+        self.cmd_name = cmd_name
+        self.working_dir = working_dir
+        self.parent = parent
+        self.children = []
+        self.executions = []
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.error = None
+
+    @property
+    def path(self):
+        # the names of the enclosing spans and this one, outermost first.
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return '/'.join(reversed(names))
+
+    def finish(self, error=None):
+        self.elapsed = time.perf_counter() - self.start
+        self.error = error
+
+    def __repr__(self):
+        return '<Span %s %s elapsed=%r>' % (
+            self.cmd_name, self.path, self.elapsed)
+
+
+class Execution(object):
+    """
+    An external command executed by a command.
+    """
+
+    def __init__(self, argv, elapsed, stdout_bytes, stderr_bytes,
+                 return_code, span=None):
+        self.argv = argv
+        self.elapsed = elapsed
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.return_code = return_code
+        self.span = span
+
+    @property
+    def operation(self):
+        return self.span.name if self.span is not None else None
+
+    def __repr__(self):
+        return '<Execution %r return_code=%r elapsed=%r>' % (
+            self.argv, self.return_code, self.elapsed)
+
+
+class Observer(object):
+    """
+    Base observer, with every notification being ignored.
+    """
+
+    def span_started(self, span):
+        pass
+
+    def span_finished(self, span):
+        pass
+
+    def executed(self, execution):
+        pass
+
+
+class Recorder(Observer):
+    """
+    Keep the outermost spans and all executions that were observed.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.executions = []
+        self._lock = threading.Lock()
+
+    def span_finished(self, span):
+        if span.parent is None:
+            with self._lock:
+                self.spans.append(span)
+
+    def executed(self, execution):
+        with self._lock:
+            self.executions.append(execution)
+
+    def summary(self):
+        """
+        Return a dict of the path of every span observed to a dict of
+        its count, total elapsed time and number of executions.
+        """
+
+        result = {}
+        stack = list(self.spans)
+        while stack:
+            span = stack.pop()
+            entry = result.setdefault(
+                span.path, {'count': 0, 'elapsed': 0.0, 'executions': 0})
+            entry['count'] += 1
+            entry['elapsed'] += span.elapsed or 0.0
+            entry['executions'] += len(span.executions)
+            stack.extend(span.children)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+            self.executions = []
+
+
+class MetricsObserver(Observer):
+    """
+    Report the observations to a metrics sink, a callable accepting the
+    metric name, its value and a dict of tags, e.g. an adapter to a
+    statsd or prometheus client.
+    """
+
+    def __init__(self, sink, prefix='pmr2.wfctrl'):
+        self.sink = sink
+        self.prefix = prefix
+
+    def span_finished(self, span):
+        tags = {
+            'backend': span.cmd_name,
+            'operation': span.name,
+            'status': 'ok' if span.error is None else 'error',
+        }
+        self.sink(self.prefix + '.operation.duration', span.elapsed, tags)
+        self.sink(self.prefix + '.operation.executions',
+                  len(span.executions), tags)
+
+    def executed(self, execution):
+        tags = {
+            'operation': execution.operation,
+            'command': ' '.join(execution.argv[:1]),
+            'return_code': execution.return_code,
+        }
+        self.sink(self.prefix + '.execute.duration', execution.elapsed, tags)
+        self.sink(self.prefix + '.execute.stdout_bytes',
+                  execution.stdout_bytes, tags)
+        self.sink(self.prefix + '.execute.stderr_bytes',
+                  execution.stderr_bytes, tags)
+
+
+def notify(observers, name, arg):
+    # an observer failing must not fail the operation.
+    for observer in observers:
+        try:
+            getattr(observer, name)(arg)
+        except Exception:
+            logger.exception('observer %r failed on %s', observer, name)
@@ -0,0 +1,200 @@
+"""
+Running an action across many workspaces at once.
+"""
+
+import logging
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+if sys.version_info > (3, 0):  # pragma: no cover
+    from urllib.parse import urlsplit
+else:  # pragma: no cover
+    from urlparse import urlsplit
+
+from .core import merge_results
+
+logger = logging.getLogger(__name__)
+
+actions = ('init', 'pull', 'save', 'push')
+
+
+class SyncResult(object):
+    """
+    The result of an action on a workspace.
+    """
+
+    def __init__(self, workspace, action, stdout=b'', stderr=b'',
+                 return_code=None, elapsed=None, error=None):
+        self.workspace = workspace
+        self.action = action
+        self.stdout = stdout
+        self.stderr = stderr
+        self.return_code = return_code
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.return_code == 0
+
+    @property
+    def skipped(self):
+        # not run, as an earlier failure stopped the run.
+        return self.return_code is None and self.error is None
+
+    def __repr__(self):
+        return '<SyncResult %s %s return_code=%r elapsed=%r>' % (
+            self.action, self.workspace.working_dir, self.return_code,
+            self.elapsed)
+
+
+def run_action(workspace, action, **kw):
+    """
+    Run the action on the workspace, returning the results as a
+    (stdout, stderr, return_code, elapsed) tuple.
+    """
+
+    start = time.perf_counter()
+    if action == 'init':
+        result = workspace.initialize(**kw)
+    elif action == 'save':
+        result = workspace.save(**kw)
+    elif action in ('pull', 'push'):
+        result = getattr(workspace.cmd, action)(workspace, **kw)
+    else:
+        raise ValueError('unknown action `%s`' % action)
+    elapsed = time.perf_counter() - start
+    return merge_results([result]) + (elapsed,)
+
+
+def workspace_host(workspace):
+    """
+    Return the host of the remote of the workspace, or an empty string
+    for a local or undefined remote.
+    """
+
+    cmd = workspace.cmd
+    if cmd is None:
+        return ''
+    remote = getattr(cmd, 'remote', None)
+    if not remote:
+        try:
+            remote = cmd._cached_read_remote(workspace)
+        except Exception:
+            logger.debug('unable to read remote of %s',
+                         workspace.working_dir)
+            remote = None
+    if not remote:
+        return ''
+    # exclude any credentials.
+    return urlsplit(remote).netloc.rsplit('@', 1)[-1]
+
+
+class SyncManager(object):
+    """
+    Run init, pull, save or push across a list of workspaces through
+    a pool of workers.
+    """
+
+    def __init__(self, workspaces, max_workers=4, executor=None,
+                 host_limit=None, fail_fast=False):
+        """
+        workspaces
+            The list of CmdWorkspace to operate on.
+        max_workers
+            The number of threads for the default executor, and the
+            number of actions that may be in flight at once.
+        executor
+            A ``concurrent.futures`` executor to use instead of the
+            default thread pool, e.g. a ``ProcessPoolExecutor``, for
+            which the workspaces and their commands must be picklable.
+        host_limit
+            The maximum number of concurrent actions per remote host.
+        fail_fast
+            Stop starting actions on the remaining workspaces on the
+            first failure, leaving their results as skipped, instead of
+            collecting the results of all of them.
+        """
+
+        self.workspaces = list(workspaces)
+        self.max_workers = max_workers
+        self.executor = executor
+        self.host_limit = host_limit
+        self.fail_fast = fail_fast
+
+    def run(self, action, **kw):
+        """
+        Run the action across the workspaces, returning a list of
+        SyncResult in the order of the workspaces.
+        """
+
+        if action not in actions:
+            raise ValueError('unknown action `%s`' % action)
+
+        results = [SyncResult(workspace, action)
+                   for workspace in self.workspaces]
+        queue = [(i, workspace_host(workspace))
+                 for i, workspace in enumerate(self.workspaces)]
+        running = {}
+        host_running = {}
+        failed = False
+
+        executor = self.executor
+        owned = executor is None
+        if owned:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while queue or running:
+                if not (failed and self.fail_fast):
+                    remaining = []
+                    for i, host in queue:
+                        # only keep as many in flight as there are
+                        # workers, so a failure stops the run promptly.
+                        if len(running) >= self.max_workers or (
+                                self.host_limit and
+                                host_running.get(host, 0) >= self.host_limit):
+                            remaining.append((i, host))
+                            continue
+                        host_running[host] = host_running.get(host, 0) + 1
+                        future = executor.submit(
+                            run_action, self.workspaces[i], action, **kw)
+                        running[future] = (i, host)
+                    queue = remaining
+                else:
+                    queue = []
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, host = running.pop(future)
+                    host_running[host] -= 1
+                    result = results[i]
+                    try:
+                        (result.stdout, result.stderr, result.return_code,
+                            result.elapsed) = future.result()
+                    except Exception as e:
+                        logger.warning('%s failed on %s: %s', action,
+                                       self.workspaces[i].working_dir, e)
+                        result.error = e
+                    if not result.ok:
+                        failed = True
+        finally:
+            if owned:
+                executor.shutdown(wait=True)
+        return results
+
+    def init(self, **kw):
+        return self.run('init', **kw)
+
+    def pull(self, **kw):
+        return self.run('pull', **kw)
+
+    def save(self, **kw):
+        return self.run('save', **kw)
+
+    def push(self, **kw):
+        return self.run('push', **kw)
@@ -107,6 +107,79 @@ class CoreTests(object):
         self.assertRaises(ValueError, wks.add_file, fn1)
         self.assertEqual(wks.get_tracked_subpaths(), [])
 
+    def test_add_files_bulk(self):
+        wks = self.make_workspace()
+        fn1 = self.write_file('Test content1', 'file1')
+        fn2 = self.write_file('Test content2', 'file2')
+        wks.add_files(['file2', fn1, fn2])
+        self.assertEqual(wks.get_tracked_subpaths(), [fn1, fn2])
+        self.assertIn('file1', wks.tracked)
+        # nothing is added when any is outside the workspace.
+        bad = self.write_file('Failure', join(self.working_dir, 'badname'))
+        fn3 = self.write_file('Test content3', 'file3')
+        self.assertRaises(ValueError, wks.add_files, [fn3, bad])
+        self.assertRaises(ValueError, wks.add_files, ['../badname'])
+        self.assertEqual(wks.get_tracked_subpaths(), [fn1, fn2])
+
+    def test_tracked_subpaths_view(self):
+        wks = self.make_workspace()
+        fn1 = self.write_file('Test content1', 'file1')
+        wks.add_file(fn1)
+        self.assertEqual(wks.get_tracked_subpaths(), [fn1])
+        view = wks._get_tracked_view()
+        # not rebuilt until the tracked files change.
+        self.assertIs(wks._get_tracked_view(), view)
+        os.mkdir(join(self.workspace_dir, 'testdir'))
+        fn2 = self.write_file('Test content2', join('testdir', 'file2'))
+        wks.add_file(fn2)
+        self.assertEqual(list(wks.iter_tracked_subpaths()), [fn1, fn2])
+        self.assertEqual(list(wks.iter_tracked_subpaths(relative=True)),
+                         ['file1', 'testdir/file2'])
+        self.assertEqual(wks.get_tracked_subpaths(relative=True),
+                         ['file1', 'testdir/file2'])
+        wks.reset()
+        self.assertEqual(wks.get_tracked_subpaths(), [])
+
+    def make_tree(self):
+        os.makedirs(join(self.workspace_dir, 'sub', 'deep'))
+        os.makedirs(join(self.workspace_dir, 'build'))
+        return sorted(self.write_file('content', name) for name in [
+            'a.txt', 'b.log', join('sub', 'c.txt'),
+            join('sub', 'deep', 'd.txt'), join('build', 'e.txt'),
+        ])
+
+    def test_add_dir(self):
+        wks = self.make_workspace()
+        self.make_tree()
+        count = wks.add_dir()
+        self.assertEqual(count, 5)
+        # the marker is not descended into.
+        self.assertEqual(wks.get_tracked_subpaths(), [
+            join(self.workspace_dir, f) for f in [
+                'a.txt', 'b.log', join('build', 'e.txt'),
+                join('sub', 'c.txt'), join('sub', 'deep', 'd.txt')]])
+        self.assertEqual(list(wks.tracked.iter_prefix('sub')), [
+            join('sub', 'c.txt'), join('sub', 'deep', 'd.txt')])
+
+    def test_add_dir_patterns(self):
+        wks = self.make_workspace()
+        self.make_tree()
+        wks.add_dir('sub', recursive=False)
+        self.assertEqual(wks.get_tracked_subpaths(), [
+            join(self.workspace_dir, 'sub', 'c.txt')])
+        wks.reset()
+        wks.add_dir(include='*.txt', exclude=['build', 'sub/deep'])
+        self.assertEqual(wks.get_tracked_subpaths(), [
+            join(self.workspace_dir, f) for f in ['a.txt', join('sub', 'c.txt')]])
+
+    def test_add_glob(self):
+        wks = self.make_workspace()
+        self.make_tree()
+        self.assertEqual(wks.add_glob('**/*.txt', exclude='build'), 3)
+        self.assertEqual(wks.get_tracked_subpaths(), [
+            join(self.workspace_dir, f) for f in [
+                'a.txt', join('sub', 'c.txt'), join('sub', 'deep', 'd.txt')]])
+
 
 def handle_access_error(func, path, exc_info):  # pragma: no cover
     """
@@ -0,0 +1,187 @@
+"""
+A local smart HTTP git server for testing the network based commands.
+
+Requires dulwich.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import unquote, urlsplit
+
+from dulwich.server import FileSystemBackend
+from dulwich.web import make_wsgi_chain
+
+
+class _Backend(FileSystemBackend):
+
+    def open_repository(self, path):
+        # the paths provided by the web application are absolute.
+        if isinstance(path, bytes):
+            path = path.decode('utf8')
+        return FileSystemBackend.open_repository(self, path.lstrip('/'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Persistent connections are required for the connection reuse by
+    # the clients to be measured.
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, which would
+    # otherwise stall on a persistent connection until the client
+    # acknowledges the headers.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            body = BytesIO()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                body.write(self.rfile.read(size))
+                self.rfile.readline()
+            return body.getvalue()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send(self, status, headers, body):
+        code, message = status.split(' ', 1)
+        self.send_response_only(int(code), message)
+        for key, value in headers:
+            if key.lower() not in ('content-length', 'transfer-encoding'):
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        authorization = server.authorization
+        if authorization and self.headers.get(
+                'Authorization') != authorization:
+            self._read_body()
+            self._send('401 Unauthorized',
+                       [('WWW-Authenticate', 'Basic realm="test"')], b'')
+            return
+
+        body = self._read_body()
+        url = urlsplit(self.path)
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(url.path),
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': server.server_address[0],
+            'SERVER_PORT': str(server.server_address[1]),
+            'SERVER_PROTOCOL': self.request_version,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for key, value in self.headers.items():
+            environ['HTTP_' + key.upper().replace('-', '_')] = value
+
+        response = {}
+        content = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return content.append
+
+        result = server.app(environ, start_response)
+        try:
+            content.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        self._send(response['status'], response['headers'], b''.join(content))
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, app, authorization=None):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.app = app
+        self.authorization = authorization
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    def get_request(self):
+        request = ThreadingHTTPServer.get_request(self)
+        with self.lock:
+            self.connections += 1
+        return request
+
+
+class GitHttpServer(object):
+    """
+    Serve the git repositories found under root over the smart HTTP
+    protocol on an ephemeral local port, counting the connections and
+    requests received.
+
+    authorization
+        If provided, requests without this exact Authorization header
+        are rejected, as a stand-in for an authenticated PMR instance.
+    """
+
+    def __init__(self, root, authorization=None):
+        self.root = root
+        self.authorization = authorization
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return 'http://%s:%d' % (host, port)
+
+    def url_for(self, name):
+        return '%s/%s' % (self.url, name)
+
+    @property
+    def connections(self):
+        return self._server.connections
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def start(self):
+        app = make_wsgi_chain(_Backend(self.root))
+        self._server = _Server(app, authorization=self.authorization)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,10 +1,47 @@
+import bisect
+import fnmatch
+import os
+import re
+import shutil
+import signal
+import struct
 import sys
+import threading
+import time
+from itertools import groupby
+from subprocess import TimeoutExpired
 
 if sys.version_info > (3, 0): # pragma: no cover
-    from urllib.parse import urlsplit, urlunsplit
+    from queue import Empty, Queue
+    from urllib.parse import unquote, urlsplit, urlunsplit
 else: # pragma: no cover
+    from Queue import Empty, Queue
+    from urllib import unquote
     from urlparse import urlsplit, urlunsplit
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_pointer_size = struct.calcsize('P')
+
+def popen_kw():
+    """
+    Return the extra keyword arguments for Popen for the external
+    commands.
+    """
+
+    extra_kw = {}
+
+    if os.name == 'posix':
+        # What this does is to prevent subprocesses from opening
+        # pty/tty for further user input/output.
+        # Still need to determine whether this is needed on Windows.
+        extra_kw['preexec_fn'] = os.setsid
+
+    return extra_kw
+
 def set_url_cred(url, username=None, password=None,
         _protocols=('http', 'https')):
     urlparts = list(urlsplit(url))
@@ -20,3 +57,400 @@ def set_url_cred(url, username=None, password=None,
     urlparts[1] = '%s:%s@%s' % (username, password, urlparts[1])
 
     return urlunsplit(urlparts)
+
+
+# the header, with the credentials following the optional scheme.
+_authorization = re.compile(r'(Authorization:\s*)(\S+\s+)?\S+', re.IGNORECASE)
+
+def redact(arg):
+    """
+    Remove the credentials from an argument of an external command.
+    """
+
+    arg = _authorization.sub(r'\1\2***', arg)
+    if '://' in arg and '@' in arg:
+        arg = set_url_cred(arg)
+    return arg
+
+
+def chunk_args(args, limit):
+    """
+    Split a sequence of command line arguments into lists such that
+    the space each list occupies on the command line stays within
+    limit, so a large number of paths may be passed to an external
+    command across as few invocations as possible.
+
+    The accounting includes the terminating null and the pointer for
+    each argument as the operating system would.  An argument that
+    exceeds the limit by itself is still emitted, on its own.
+    """
+
+    chunk = []
+    size = 0
+    for arg in args:
+        arg_size = len(arg) + 1 + _pointer_size
+        if chunk and size + arg_size > limit:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(arg)
+        size += arg_size
+    if chunk:
+        yield chunk
+
+
+def kill_process(proc):
+    """
+    Kill the process, along with the process group it leads such that
+    the processes it started (e.g. the remote helpers of git) are also
+    killed.
+    """
+
+    if os.name == 'posix':
+        try:
+            if os.getpgid(proc.pid) == proc.pid:
+                os.killpg(proc.pid, signal.SIGKILL)
+                return
+        except OSError:
+            pass
+    try:
+        proc.kill()
+    except OSError:  # pragma: no cover
+        pass
+
+
+class CmdResult(tuple):
+    """
+    The (stdout, stderr, return_code) of an executed command or of an
+    operation of a command, such that it may still be unpacked as such.
+
+    timed_out, cancelled
+        Whether the command was killed for exceeding its timeout or for
+        being cancelled.
+    duration
+        The number of seconds taken.
+    argv
+        The command line that was executed, with the credentials
+        redacted.
+    operation
+        The name of the operation of the command that returned this.
+    results
+        The results of the steps of an aggregate result, such as the
+        one returned by save.
+
+    Only the attributes that differ from their defaults are stored, so
+    most results are no larger than the tuple itself.
+    """
+
+    timed_out = False
+    cancelled = False
+    duration = None
+    operation = None
+    results = ()
+    _argv = None
+
+    def __new__(cls, stdout, stderr, return_code, timed_out=False,
+                cancelled=False, duration=None, argv=None, operation=None,
+                results=()):
+        result = tuple.__new__(cls, (stdout, stderr, return_code))
+        if timed_out:
+            result.timed_out = timed_out
+        if cancelled:
+            result.cancelled = cancelled
+        if duration is not None:
+            result.duration = duration
+        if argv is not None:
+            result._argv = argv
+        if operation is not None:
+            result.operation = operation
+        if results:
+            result.results = results
+        return result
+
+    @property
+    def stdout(self):
+        return self[0]
+
+    @property
+    def stderr(self):
+        return self[1]
+
+    @property
+    def return_code(self):
+        return self[2]
+
+    # as named by subprocess.
+    returncode = return_code
+
+    @property
+    def ok(self):
+        return self[2] == 0
+
+    @property
+    def argv(self):
+        # redacted when requested, as this is rarely needed.
+        if self._argv is None:
+            return None
+        return [redact(str(arg)) for arg in self._argv]
+
+    @property
+    def failed(self):
+        """
+        The results of the steps that failed, or this result if it is
+        not an aggregate and failed.
+        """
+
+        if not self.results:
+            return [] if self.ok else [self]
+        return [result for result in self.results
+                if isinstance(result, tuple) and result[2]]
+
+
+# The return code for the commands that exceeded their timeout, as
+# used by the timeout utility.
+TIMEOUT_RETURN_CODE = 124
+
+
+def stream_process(proc, callback, chunk_size=8192, maxsize=16,
+                   timeout=None):
+    """
+    Pass the output of the process to callback as it arrives, as
+    callback('stdout', chunk) or callback('stderr', chunk), and return
+    the return code of the process once it exits.
+
+    Both pipes are read concurrently, with at most maxsize chunks held
+    between the readers and the callback; a slow callback will pause
+    the process rather than have its output accumulate in memory.
+
+    If the process does not complete within timeout seconds it is
+    killed and TimeoutExpired is raised.
+    """
+
+    queue = Queue(maxsize)
+
+    def reader(name, pipe):
+        try:
+            read = getattr(pipe, 'read1', pipe.read)
+            for chunk in iter(lambda: read(chunk_size), b''):
+                queue.put((name, chunk))
+        finally:
+            queue.put((name, None))
+
+    if proc.stdin:
+        proc.stdin.close()
+    readers = [
+        threading.Thread(target=reader, args=(name, pipe))
+        for name, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr))
+        if pipe is not None
+    ]
+    for thread in readers:
+        thread.daemon = True
+        thread.start()
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    remaining = len(readers)
+    try:
+        while remaining:
+            if deadline is None:
+                name, chunk = queue.get()
+            else:
+                try:
+                    name, chunk = queue.get(
+                        timeout=max(deadline - time.monotonic(), 0))
+                except Empty:
+                    raise TimeoutExpired(proc.args, timeout)
+            if chunk is None:
+                remaining -= 1
+                continue
+            callback(name, chunk)
+    except BaseException:
+        # the readers must not remain blocked on the full queue.
+        kill_process(proc)
+        while remaining:
+            if queue.get()[1] is None:
+                remaining -= 1
+        raise
+    finally:
+        for thread in readers:
+            thread.join()
+        for pipe in (proc.stdout, proc.stderr):
+            if pipe is not None:
+                pipe.close()
+    return proc.wait()
+
+
+def local_path(location):
+    """
+    Return the absolute path of the directory location refers to, as a
+    path or as a ``file://`` url, or None if it is not a local directory.
+    """
+
+    if not location:
+        return None
+    if isinstance(location, bytes):
+        location = location.decode('utf8')
+    parts = urlsplit(location)
+    if parts.scheme == 'file':
+        if parts.netloc not in ('', 'localhost'):
+            return None
+        location = unquote(parts.path)
+    if not os.path.isdir(location):
+        return None
+    return os.path.abspath(location)
+
+
+# The ioctl request to share the extents of a file with another (i.e.
+# a reflink), on the filesystems that support it, e.g. btrfs and xfs.
+_FICLONE = 0x40049409
+
+def _copy_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), 1 << 30):
+                    pass
+                return
+            except OSError:
+                # e.g. across filesystems on older kernels.
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def link_or_copy(src, dst):
+    """
+    Hard link dst to src, or where the filesystem does not allow it,
+    copy src to dst as a reflink, through the kernel, or by reading it,
+    in that order of preference.  Only suitable for files that are
+    never modified in place, such as the objects of a repository.
+    """
+
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    _copy_file(src, dst)
+    shutil.copymode(src, dst)
+
+
+def link_tree(src, dst):
+    """
+    Replicate the files within the directory src into dst through
+    link_or_copy, leaving the files that already exist in dst.
+    """
+
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in files:
+            if not os.path.exists(os.path.join(target, name)):
+                link_or_copy(
+                    os.path.join(root, name), os.path.join(target, name))
+
+
+class PathIndex(object):
+    """
+    A set of relative paths kept as a single sorted list, such that
+    membership and the paths within a directory are found by bisection
+    and iteration is in order.  Paths added are only merged into the
+    list when it is next read, so adding many paths costs one sort.
+    The version is incremented by every change, for the views derived
+    from the index to be invalidated by.
+    """
+
+    def __init__(self, paths=()):
+        self._paths = []
+        self._pending = list(paths)
+        self.version = 0
+
+    def _flush(self):
+        if self._pending:
+            paths = self._paths
+            paths.extend(self._pending)
+            self._pending = []
+            paths.sort()
+            self._paths = [path for path, _ in groupby(paths)]
+        return self._paths
+
+    def add(self, path):
+        self._pending.append(path)
+        self.version += 1
+
+    def update(self, paths):
+        self._pending.extend(paths)
+        self.version += 1
+
+    def discard(self, path):
+        paths = self._flush()
+        i = bisect.bisect_left(paths, path)
+        if i < len(paths) and paths[i] == path:
+            del paths[i]
+            self.version += 1
+
+    def clear(self):
+        self._paths = []
+        self._pending = []
+        self.version += 1
+
+    def __contains__(self, path):
+        paths = self._flush()
+        i = bisect.bisect_left(paths, path)
+        return i < len(paths) and paths[i] == path
+
+    def __len__(self):
+        return len(self._flush())
+
+    def __iter__(self):
+        return iter(self._flush())
+
+    def iter_prefix(self, directory, sep=os.sep):
+        """
+        Iterate over the paths within directory, in order.
+        """
+
+        paths = self._flush()
+        if not directory:
+            return iter(paths)
+        prefix = directory.rstrip(sep) + sep
+        start = bisect.bisect_left(paths, prefix)
+        end = bisect.bisect_left(paths, prefix[:-1] + chr(ord(sep) + 1))
+        return iter(paths[start:end])
+
+
+def compile_patterns(patterns):
+    """
+    Return a function that tests whether a relative path, with ``/`` as
+    the separator, matches any of the glob patterns.  Like gitignore,
+    a pattern without a ``/`` matches the last component of the path,
+    while other patterns match the whole path.  Returns None for no
+    patterns.
+    """
+
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    names = []
+    paths = []
+    for pattern in patterns or ():
+        pattern = pattern.strip('/')
+        (paths if '/' in pattern else names).append(fnmatch.translate(pattern))
+    if not names and not paths:
+        return None
+    name_match = names and re.compile('|'.join(names)).match
+    path_match = paths and re.compile('|'.join(paths)).match
+
+    def match(path):
+        if path_match and path_match(path):
+            return True
+        return bool(name_match and name_match(path.rsplit('/', 1)[-1]))
+
+    return match
@@ -0,0 +1,201 @@
+from unittest import TestCase, skipIf
+from unittest import mock
+
+import asyncio
+import os
+from concurrent.futures import Executor
+from os.path import isdir, join
+
+from pmr2.wfctrl.aio import AsyncCmdWorkspace
+from pmr2.wfctrl.aio import AsyncDvcsCmd
+from pmr2.wfctrl.core import BaseDvcsCmdBin
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.cmd import DulwichDvcsCmd
+from pmr2.wfctrl.cmd import GitDvcsCmd
+
+from pmr2.wfctrl.testing.base import CoreTestCase
+from pmr2.wfctrl.testing.base import CoreTests
+
+
+class FailExecutor(Executor):
+
+    def submit(self, *a, **kw):
+        raise AssertionError('executor used')
+
+
+class AsyncExecuteTestCase(TestCase):
+
+    def test_timeout(self):
+        cmd = AsyncDvcsCmd(BaseDvcsCmdBin(cmd_binary='python', timeout=0.5))
+        result = asyncio.run(
+            cmd.execute('-c', 'import time; time.sleep(30)'))
+        self.assertTrue(result.timed_out)
+        self.assertEqual(result[2], 124)
+
+        result = asyncio.run(cmd.execute('-c', 'print("done")', timeout=10))
+        self.assertEqual(result, (b'done\n', b'', 0))
+
+    def test_cancel(self):
+        cmd = AsyncDvcsCmd(BaseDvcsCmdBin(cmd_binary='python'))
+
+        async def run():
+            task = asyncio.ensure_future(
+                cmd.execute('-c', 'import time; time.sleep(30)'))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await asyncio.wait([task], timeout=10)
+            return task
+
+        processes = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def capture(*a, **kw):
+            process = await create_subprocess_exec(*a, **kw)
+            processes.append(process)
+            return process
+
+        with mock.patch('asyncio.create_subprocess_exec', capture):
+            self.assertTrue(asyncio.run(run()).cancelled())
+        # the killed process was reaped before the loop was closed.
+        self.assertIsNotNone(processes[0].returncode)
+
+
+@skipIf(not GitDvcsCmd.available(), 'git is not available')
+class AsyncGitDvcsCmdTestCase(CoreTestCase):
+
+    def setUp(self):
+        super(AsyncGitDvcsCmdTestCase, self).setUp()
+        self.helper = CoreTests()
+        self.helper.workspace_dir = self.workspace_dir
+
+    def _log(self, working_dir):
+        return GitDvcsCmd._execute(
+            ['--git-dir=%s' % join(working_dir, '.git'), 'log'])
+
+    def test_save(self):
+        async def run():
+            cmd = AsyncDvcsCmd(GitDvcsCmd())
+            cmd.set_committer('Tester', 'test@example.com')
+            workspace = AsyncCmdWorkspace(self.workspace_dir, cmd)
+            await workspace.initialize()
+            self.assertTrue(isdir(join(self.workspace_dir, '.git')))
+            workspace.add_file(self.helper.write_file('Test content'))
+            await workspace.save(message='async save')
+
+        asyncio.run(run())
+        stdout, _, _ = self._log(self.workspace_dir)
+        self.assertIn(b'async save', stdout)
+
+    def test_subprocess_ops_on_loop(self):
+        async def run():
+            cmd = AsyncDvcsCmd(GitDvcsCmd(), executor=FailExecutor())
+            cmd.set_committer('Tester', 'test@example.com')
+            workspace = CmdWorkspace(self.workspace_dir)
+            _, _, return_code = await cmd.init_new(workspace)
+            self.assertEqual(return_code, 0)
+            filename = self.helper.write_file('Test content')
+            await cmd.add_paths(workspace, [filename])
+            _, _, return_code = await cmd.commit(workspace, 'on loop')
+            self.assertEqual(return_code, 0)
+
+        asyncio.run(run())
+        stdout, _, _ = self._log(self.workspace_dir)
+        self.assertIn(b'on loop', stdout)
+
+    def test_add_paths_removed(self):
+        async def run():
+            cmd = AsyncDvcsCmd(GitDvcsCmd())
+            cmd.set_committer('Tester', 'test@example.com')
+            workspace = CmdWorkspace(self.workspace_dir)
+            await cmd.init_new(workspace)
+            filenames = [self.helper.write_file(name, name)
+                         for name in ['a', 'b']]
+            await cmd.add_paths(workspace, filenames)
+            await cmd.commit(workspace, 'added')
+            # the removal is staged, which depends on the index.
+            os.remove(filenames[0])
+            await cmd.add_paths(workspace, filenames + ['missing'])
+            await cmd.commit(workspace, 'removed')
+
+        asyncio.run(run())
+        stdout, _, _ = GitDvcsCmd._execute([
+            '--git-dir=%s' % join(self.workspace_dir, '.git'),
+            'ls-tree', '--name-only', 'HEAD'])
+        self.assertEqual(stdout.split(), [b'b'])
+
+    def test_pull_push_concurrent(self):
+        remote = join(self.working_dir, 'remote')
+        GitDvcsCmd._execute(['init', remote, '--bare'])
+
+        async def run():
+            cmd = AsyncDvcsCmd(GitDvcsCmd(remote=remote), limit=2)
+            cmd.set_committer('Tester', 'test@example.com')
+            workspaces = []
+            for i in range(4):
+                target = join(self.working_dir, 'clone%d' % i)
+                workspace = AsyncCmdWorkspace(target, cmd)
+                await workspace.initialize()
+                workspaces.append(workspace)
+
+            # the commit pushed by the first is pulled concurrently by
+            # the others.
+            first = workspaces[0]
+            first.add_file(join(first.working_dir, 'file'))
+            with open(join(first.working_dir, 'file'), 'w') as fd:
+                fd.write('content')
+            await first.save(message='first')
+            results = await asyncio.gather(
+                *[workspace.pull() for workspace in workspaces[1:]])
+            return results
+
+        results = asyncio.run(run())
+        for stdout, stderr, return_code in results:
+            self.assertEqual(return_code, 0)
+        for i in range(1, 4):
+            self.assertTrue(os.path.exists(
+                join(self.working_dir, 'clone%d' % i, 'file')))
+
+    @skipIf(not DulwichDvcsCmd.available(), 'dulwich is not available')
+    def test_clone_cache_concurrent(self):
+        from pmr2.wfctrl.testing.gitserver import GitHttpServer
+        cmd = GitDvcsCmd()
+        cmd.set_committer('Tester', 'test@example.com')
+        workspace = CmdWorkspace(self.workspace_dir, cmd)
+        workspace.add_file(self.helper.write_file('Test content'))
+        workspace.save(message='cached')
+        cache_dir = join(self.working_dir, 'cache')
+
+        async def run(remote):
+            cmd = AsyncDvcsCmd(GitDvcsCmd(remote=remote, cache_dir=cache_dir))
+            # the clones are made through the cache, under its lock.
+            return await asyncio.gather(*[cmd.clone(CmdWorkspace(
+                join(self.working_dir, 'clone%d' % i))) for i in range(3)])
+
+        with GitHttpServer(self.working_dir) as server:
+            results = asyncio.run(run(server.url_for('workspace')))
+        for stdout, stderr, return_code in results:
+            self.assertEqual(return_code, 0)
+        for i in range(3):
+            stdout, _, _ = self._log(join(self.working_dir, 'clone%d' % i))
+            self.assertIn(b'cached', stdout)
+
+
+@skipIf(not DulwichDvcsCmd.available(), 'dulwich is not available')
+class AsyncDulwichDvcsCmdTestCase(CoreTestCase):
+
+    def test_save(self):
+        helper = CoreTests()
+        helper.workspace_dir = self.workspace_dir
+
+        async def run():
+            cmd = AsyncDvcsCmd(DulwichDvcsCmd())
+            cmd.set_committer('Tester', 'test@example.com')
+            workspace = AsyncCmdWorkspace(self.workspace_dir, cmd)
+            await workspace.initialize()
+            filename = helper.write_file('Test content')
+            workspace.add_file(filename)
+            await workspace.save(message='async save')
+            self.assertEqual(await workspace.status(), {})
+            return await cmd.read_file(workspace, filename)
+
+        self.assertEqual(asyncio.run(run()), b'Test content')
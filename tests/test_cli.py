@@ -0,0 +1,110 @@
+from unittest import skipIf
+
+import io
+import os
+from os.path import join
+
+from pmr2.wfctrl import cli
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.cmd import GitDvcsCmd
+from pmr2.wfctrl.discover import forget_workspaces
+
+from pmr2.wfctrl.testing.base import CoreTestCase
+
+
+@skipIf(not GitDvcsCmd.available(), 'git is not available')
+class CliTestCase(CoreTestCase):
+
+    def setUp(self):
+        super(CliTestCase, self).setUp()
+        self.remote = join(self.working_dir, 'remote')
+        GitDvcsCmd._execute(['init', '--bare', self.remote])
+        seed = CmdWorkspace(join(self.working_dir, 'seed'),
+                            GitDvcsCmd(remote=self.remote))
+        seed.cmd.set_committer('Tester', 'test@example.com')
+        with open(join(seed.working_dir, 'seed'), 'w') as fd:
+            fd.write('seed')
+        seed.add_file('seed')
+        seed.save(message='seed')
+        self.root = join(self.working_dir, 'root')
+        self.clones = []
+        for name in ['one', join('nested', 'two')]:
+            cmd = GitDvcsCmd(remote=self.remote)
+            cmd.set_committer('Tester', 'test@example.com')
+            self.clones.append(CmdWorkspace(join(self.root, name), cmd))
+        os.makedirs(join(self.root, 'empty'))
+
+    def tearDown(self):
+        forget_workspaces()
+        super(CliTestCase, self).tearDown()
+
+    def run_cli(self, *argv):
+        out = io.StringIO()
+        return cli.main(list(argv), out=out), out.getvalue()
+
+    def test_scan(self):
+        code, output = self.run_cli('scan', self.root, '--workers', '2')
+        self.assertEqual(code, 0)
+        lines = output.splitlines()
+        self.assertEqual(len(lines), 3)
+        # in the order of their paths.
+        self.assertTrue(lines[0].endswith(join('nested', 'two')))
+        self.assertTrue(lines[1].endswith(' one'))
+        self.assertTrue(lines[2].startswith('2 workspaces in '))
+
+        code, output = self.run_cli('scan', self.root, '--max-depth', '1')
+        self.assertTrue(output.splitlines()[-1].startswith('1 workspace in '))
+
+    def test_scan_backend(self):
+        code, output = self.run_cli('scan', self.root, '--backend', 'git')
+        self.assertEqual(output.split()[:4],
+                         ['git', join('nested', 'two'), 'git', 'one'])
+
+    def test_status(self):
+        code, output = self.run_cli('status', self.root)
+        self.assertEqual(code, 0)
+        lines = output.splitlines()
+        self.assertTrue(lines[1].endswith(self.remote))
+        self.assertIn(' one  clean  ', lines[1])
+        self.assertTrue(lines[-1].startswith('2 workspaces in '))
+
+        with open(join(self.clones[0].working_dir, 'seed'), 'w') as fd:
+            fd.write('modified')
+        code, output = self.run_cli('status', self.root)
+        self.assertIn(' one  1 changed  ', output.splitlines()[1])
+
+    def test_push_pull_all(self):
+        one, two = self.clones
+        filename = join(one.working_dir, 'file')
+        with open(filename, 'w') as fd:
+            fd.write('content')
+        one.cmd.add_paths(one, [filename])
+        one.cmd.commit(one, 'first')
+
+        code, output = self.run_cli(
+            'push-all', self.root, '--backend', 'git', '--fail-fast')
+        self.assertEqual(code, 0)
+        lines = output.splitlines()
+        self.assertTrue(lines[1].endswith(' one  ok'))
+        self.assertIn('2 workspaces in ', lines[2])
+        self.assertTrue(lines[3].startswith('slowest: '))
+
+        code, output = self.run_cli('pull-all', self.root, '--workers', '1')
+        self.assertEqual(code, 0)
+        self.assertTrue(os.path.exists(join(two.working_dir, 'file')))
+
+    def test_pull_all_failed(self):
+        GitDvcsCmd._execute(['--git-dir', join(
+            self.clones[0].working_dir, '.git'), 'remote', 'set-url',
+            'origin', join(self.working_dir, 'missing')])
+        code, output = self.run_cli('pull-all', self.root)
+        self.assertEqual(code, 1)
+        self.assertIn('failed (', output)
+        self.assertIn(', 1 failed', output)
+
+    def test_arguments(self):
+        self.assertRaises(SystemExit, self.run_cli, 'scan')
+        self.assertRaises(
+            SystemExit, self.run_cli, 'scan', self.root, '--workers', '0')
+        self.assertRaises(
+            SystemExit, self.run_cli, 'scan', self.root, '--backend', 'none')
@@ -1,7 +1,11 @@
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 import os
 from os.path import join
+import shutil
+import tempfile
+import threading
+import time
 
 from pmr2.wfctrl import core
 from pmr2.wfctrl.core import BaseCmd
@@ -19,10 +23,14 @@ from pmr2.wfctrl.testing.base import CoreTests
 class CoreCmdRegistrationTestCase(TestCase):
 
     def setUp(self):
-        self._orig_cmd, core._cmd_classes = core._cmd_classes, {}
+        self._orig_cmd, core._cmd_classes = core._cmd_classes, []
+        self._orig_cache, core._available_cache = core._available_cache, {}
+        self.working_dir = tempfile.mkdtemp()
 
     def tearDown(self):
         core._cmd_classes = self._orig_cmd
+        core._available_cache = self._orig_cache
+        shutil.rmtree(self.working_dir)
 
     def test_register_avail(self):
         class TestCmd(BaseCmd):
@@ -33,10 +41,11 @@ class CoreCmdRegistrationTestCase(TestCase):
             def available(self):
                 return True
         core.register_cmd(TestCmd)
-        self.assertEqual(core._cmd_classes.get('.testmarker'), TestCmd)
+        self.assertEqual(core.get_cmd_by_marker('.testmarker'), TestCmd)
         self.assertEqual(core.get_cmd_by_name('test_cmd'), TestCmd)
         core.register_cmd(TestCmd)
         self.assertEqual(len(core._cmd_classes), 1)
+        self.assertEqual(core.get_cmd_markers(), ['.testmarker'])
 
     def test_register_unavail(self):
         class TestCmd(BaseCmd):
@@ -45,7 +54,72 @@ class CoreCmdRegistrationTestCase(TestCase):
             def available(self):
                 return False
         core.register_cmd(TestCmd)
-        self.assertEqual(len(core._cmd_classes), 0)
+        self.assertIsNone(core.get_cmd_by_marker('.testmarker'))
+        self.assertIsNone(core.get_cmd_by_name('test_cmd'))
+
+    def test_register_priority(self):
+        class FirstCmd(BaseCmd):
+            marker = '.testmarker'
+            name = 'test_cmd'
+            avail = False
+
+            @classmethod
+            def available(cls):
+                return cls.avail
+
+        class SecondCmd(FirstCmd):
+            avail = True
+
+        class ThirdCmd(FirstCmd):
+            avail = True
+
+        core.register_cmd(FirstCmd, SecondCmd, ThirdCmd)
+        # first available for the marker, last available for the name.
+        self.assertEqual(core.get_cmd_by_marker('.testmarker'), SecondCmd)
+        self.assertEqual(core.get_cmd_by_name('test_cmd'), ThirdCmd)
+
+    def test_register_lazy(self):
+        calls = []
+
+        class TestCmd(BaseCmd):
+            marker = '.testmarker'
+            name = 'test_cmd'
+
+            @classmethod
+            def available(cls):
+                calls.append(cls)
+                return True
+
+        core.register_cmd(TestCmd)
+        self.assertEqual(calls, [])
+        self.assertEqual(core.get_cmd_by_name('test_cmd'), TestCmd)
+        self.assertEqual(core.get_cmd_by_marker('.testmarker'), TestCmd)
+        self.assertEqual(calls, [TestCmd])
+
+        core.clear_available_cache()
+        self.assertEqual(core.get_cmd_by_name('test_cmd'), TestCmd)
+        self.assertEqual(calls, [TestCmd, TestCmd])
+
+    def test_available_cache_persist(self):
+        class TestCmd(BaseCmd):
+            marker = '.testmarker'
+            name = 'test_cmd'
+
+            @classmethod
+            def available(cls):
+                raise AssertionError('should not be called')
+
+        filename = join(self.working_dir, 'cache.json')
+        core.register_cmd(TestCmd)
+        core._available_cache[core._available_key(TestCmd)] = True
+        core.dump_available_cache(filename)
+
+        core.clear_available_cache()
+        core.load_available_cache(filename)
+        self.assertEqual(core.get_cmd_by_name('test_cmd'), TestCmd)
+
+        # missing files are ignored.
+        core.load_available_cache(join(self.working_dir, 'missing'))
 
 
 class BaseCmdTestCase(TestCase):
@@ -87,6 +161,150 @@ class BaseDvcsCmdBinTestCase(TestCase):
         # (stdout, stderr, return_code)
         self.assertEqual(len(vcs.execute()), 3)
 
+    @skipIf(os.name == 'nt', 'requires a posix executable script')
+    def test_dvcs_available_cache(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        binary = join(root, 'fakevcs')
+        with open(binary, 'w') as fd:
+            fd.write('#!/bin/sh\n')
+        os.chmod(binary, 0o755)
+
+        self.assertTrue(BaseDvcsCmdBin.available(binary))
+        key = (binary, os.environ.get('PATH'))
+        self.assertEqual(core._binary_cache[key][0], binary)
+
+        # an instance makes use of the same cache
+        core._binary_cache[key] = (binary, core._stat_signature(binary))
+        entry = core._binary_cache[key]
+        BaseDvcsCmdBin(cmd_binary=binary)
+        self.assertIs(core._binary_cache[key], entry)
+
+        # a modified binary gets located again.
+        with open(binary, 'w') as fd:
+            fd.write('#!/bin/sh\nexit 0\n')
+        self.assertTrue(BaseDvcsCmdBin.available(binary))
+        self.assertIsNot(core._binary_cache[key], entry)
+
+        # a removed binary is no longer available.
+        os.unlink(binary)
+        self.assertFalse(BaseDvcsCmdBin.available(binary))
+        self.assertNotIn(key, core._binary_cache)
+
+    def test_dvcs_invalidate_available(self):
+        self.assertTrue(BaseDvcsCmdBin.available('python'))
+        BaseDvcsCmdBin.invalidate_available('python')
+        self.assertFalse(any(
+            key[0] == 'python' for key in core._binary_cache))
+        self.assertTrue(BaseDvcsCmdBin.available('python'))
+        BaseDvcsCmdBin.invalidate_available()
+        self.assertEqual(core._binary_cache, {})
+
+    def test_dvcs_execute_timeout(self):
+        vcs = BaseDvcsCmdBin(cmd_binary='python', timeout=0.5)
+        start = time.monotonic()
+        result = vcs.execute('-c', 'import time; time.sleep(30)')
+        self.assertTrue(time.monotonic() - start < 10)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.cancelled)
+        self.assertEqual(result[2], core.TIMEOUT_RETURN_CODE)
+        self.assertIn(b'timeout', result[1])
+
+        # per call timeout overrides, with output streamed.
+        chunks = []
+        result = vcs.execute(
+            '-c', 'import time; print("started", flush=True); '
+            'time.sleep(30)', callback=lambda n, c: chunks.append(c),
+            timeout=1)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(b''.join(chunks).strip(), b'started')
+
+        result = vcs.execute('-c', 'print("done")', timeout=10)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(result, (b'done\n', b'', 0))
+        self.assertTrue(result.ok)
+        self.assertTrue(result.duration >= 0)
+        self.assertEqual(result.argv, ['python', '-c', 'print("done")'])
+
+    @skipIf(not os.path.isdir('/proc'), 'requires procfs')
+    def test_dvcs_execute_timeout_kills_group(self):
+        vcs = BaseDvcsCmdBin(cmd_binary='python', timeout=1)
+        pid_file = tempfile.mktemp()
+        self.addCleanup(lambda: os.path.exists(pid_file) and
+                        os.unlink(pid_file))
+        result = vcs.execute('-c', (
+            'import subprocess, sys, time\n'
+            'p = subprocess.Popen([sys.executable, "-c", '
+            '"import time; time.sleep(30)"])\n'
+            'open(%r, "w").write(str(p.pid))\n'
+            'time.sleep(30)\n') % pid_file)
+        self.assertTrue(result.timed_out)
+        with open(pid_file) as fd:
+            pid = int(fd.read())
+        # the child started by the command is gone (or a zombie).
+        for i in range(50):
+            try:
+                with open('/proc/%d/stat' % pid) as fd:
+                    state = fd.read().rsplit(')', 1)[1].split()[0]
+            except (IOError, OSError):
+                state = None
+            if state in (None, 'Z'):
+                break
+            time.sleep(0.1)
+        self.assertIn(state, (None, 'Z'))
+
+    def test_dvcs_execute_cancel(self):
+        vcs = BaseDvcsCmdBin(cmd_binary='python')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            vcs.execute('-c', 'import time; time.sleep(30)')))
+        thread.start()
+        for i in range(100):
+            if vcs.cancel():
+                break
+            time.sleep(0.05)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(results[0].cancelled)
+        self.assertFalse(results[0].timed_out)
+        self.assertNotEqual(results[0][2], 0)
+        # nothing left to cancel.
+        self.assertEqual(vcs.cancel(), 0)
+
+    def test_dvcs_execute_chunked(self):
+        calls = []
+
+        class TestCmd(BaseDvcsCmdBin):
+            cmd_binary = 'python'
+            args_max = 128
+
+            def execute(self, *args):
+                calls.append(args)
+                return (b'out', b'', len(calls) - 1)
+
+        cmd = TestCmd()
+        paths = ['path%02d' % i for i in range(20)]
+        stdout, stderr, return_code = cmd.execute_chunked(['add'], paths)
+        self.assertTrue(len(calls) > 1)
+        self.assertEqual(
+            [p for args in calls for p in args if p != 'add'], paths)
+        self.assertTrue(all(args[0] == 'add' for args in calls))
+        self.assertEqual(stdout, b'out' * len(calls))
+        # first non-zero return code
+        self.assertEqual(return_code, 1)
+
+    def test_dvcs_add_paths_default(self):
+        added = []
+
+        class TestCmd(BaseDvcsCmd):
+            def add(self, workspace, path, **kw):
+                added.append(path)
+                return (path.encode(), b'', 0)
+
+        result = TestCmd().add_paths(None, ['a', 'b'])
+        self.assertEqual(added, ['a', 'b'])
+        self.assertEqual(result, (b'ab', b'', 0))
+
     def test_dvcs_default_fails(self):
         cmd = BaseDvcsCmdBin(cmd_binary='python')
         workspace = None
@@ -99,6 +317,17 @@ class BaseDvcsCmdBinTestCase(TestCase):
         self.assertRaises(NotImplementedError, cmd.pull, workspace)
         self.assertRaises(NotImplementedError, cmd.push, workspace)
         self.assertRaises(NotImplementedError, cmd.reset_to_remote, workspace)
+        self.assertRaises(NotImplementedError, cmd.read_file, workspace, '')
+
+    def test_dvcs_close(self):
+        with BaseDvcsCmdBin(cmd_binary='python') as cmd:
+            self.assertTrue(isinstance(cmd, BaseDvcsCmdBin))
+        cmd.close()
+
+    def test_dvcs_session(self):
+        cmd = BaseDvcsCmd()
+        with cmd.session(None) as repo:
+            self.assertIsNone(repo)
 
 
 class BaseWorkspaceTestCase(TestCase):
@@ -117,6 +346,11 @@ class FileWorkspaceTestCase(CoreTestCase, CoreTests):
     def make_workspace(self):
         return Workspace(self.workspace_dir)
 
+    def test_add_glob_special_working_dir(self):
+        self.workspace_dir = join(self.working_dir, 'g[1]*')
+        os.mkdir(self.workspace_dir)
+        self.test_add_glob()
+
 
 class _DummyCmd(object):
     marker = '.marker'
@@ -158,3 +392,8 @@ class BareCmdWorkspaceTestCase(CoreTestCase, CoreTests):
     def test_cmd_workspace_no_marker_auto(self):
         wks = CmdWorkspace(self.workspace_dir, auto=True)
         self.assertTrue(wks.cmd is None)
+
+    def test_cmd_workspace_session_no_cmd_session(self):
+        wks = CmdWorkspace(self.workspace_dir, _DummyCmd())
+        with wks.session() as repo:
+            self.assertIsNone(repo)
@@ -0,0 +1,132 @@
+from unittest import TestCase
+from unittest import mock
+
+import os
+from os.path import join
+import shutil
+import tempfile
+
+from pmr2.wfctrl import core
+from pmr2.wfctrl.core import BaseDvcsCmd
+from pmr2.wfctrl.core import CmdWorkspace
+from pmr2.wfctrl.core import register_cmd
+from pmr2.wfctrl.discover import discover_workspaces
+from pmr2.wfctrl.discover import forget_workspaces
+from pmr2.wfctrl.discover import scan_dir
+
+
+class FirstCmd(BaseDvcsCmd):
+    marker = '.first'
+    name = 'first'
+
+    @classmethod
+    def available(cls):
+        return True
+
+
+class SecondCmd(BaseDvcsCmd):
+    marker = '.second'
+    name = 'second'
+
+    @classmethod
+    def available(cls):
+        return True
+
+
+class UnavailableCmd(BaseDvcsCmd):
+    marker = '.unavailable'
+    name = 'unavailable'
+
+    @classmethod
+    def available(cls):
+        return False
+
+
+class DiscoverTestCase(TestCase):
+
+    def setUp(self):
+        self._orig_cmd, core._cmd_classes = core._cmd_classes, []
+        self._orig_cache, core._available_cache = core._available_cache, {}
+        self._orig_markers = core._workspace_markers.copy()
+        core._workspace_markers.clear()
+        register_cmd(FirstCmd, SecondCmd, UnavailableCmd)
+        self.root = tempfile.mkdtemp()
+        for path in [
+                join('a', '.first'),
+                # not descended into, being within a workspace.
+                join('a', 'nested', '.second'),
+                join('b', 'c', '.second'),
+                # the first marker has priority.
+                join('d', '.first'),
+                join('d', '.second'),
+                join('e', '.unavailable'),
+                join('f', 'g', 'h', '.first'),
+                ]:
+            os.makedirs(join(self.root, path))
+        with open(join(self.root, 'b', '.first'), 'w') as fd:
+            fd.write('not a directory')
+        os.symlink(join(self.root, 'a'), join(self.root, 'link'))
+
+    def tearDown(self):
+        core._cmd_classes = self._orig_cmd
+        core._available_cache = self._orig_cache
+        core._workspace_markers.clear()
+        core._workspace_markers.update(self._orig_markers)
+        shutil.rmtree(self.root)
+
+    def expected(self):
+        return {
+            join(self.root, 'a'): FirstCmd,
+            join(self.root, 'b', 'c'): SecondCmd,
+            join(self.root, 'd'): FirstCmd,
+            join(self.root, 'f', 'g', 'h'): FirstCmd,
+        }
+
+    def test_scan_dir(self):
+        self.assertEqual(scan_dir(join(self.root, 'd'), ['.second', '.first']),
+                         ('.second', []))
+        marker, subdirs = scan_dir(self.root, ['.first'])
+        self.assertIsNone(marker)
+        self.assertEqual(sorted(subdirs), ['a', 'b', 'd', 'e', 'f'])
+        self.assertEqual(scan_dir(join(self.root, 'missing'), ['.first']),
+                         (None, []))
+
+    def test_discover(self):
+        result = discover_workspaces(self.root)
+        self.assertEqual(result, self.expected())
+        self.assertEqual(list(result), sorted(result))
+
+    def test_discover_serial(self):
+        self.assertEqual(
+            discover_workspaces(self.root, max_workers=1), self.expected())
+
+    def test_discover_max_depth(self):
+        self.assertEqual(discover_workspaces(self.root, max_depth=0), {})
+        self.assertEqual(sorted(discover_workspaces(self.root, max_depth=1)),
+                         [join(self.root, 'a'), join(self.root, 'd')])
+
+    def test_discover_cache(self):
+        discover_workspaces(self.root)
+        # the workspaces are constructed without probing for markers.
+        with mock.patch('pmr2.wfctrl.core.isdir',
+                        side_effect=AssertionError('probed')):
+            workspace = CmdWorkspace(join(self.root, 'b', 'c'), auto=True)
+        self.assertTrue(isinstance(workspace.cmd, SecondCmd))
+
+        # rediscovery drops the workspaces that are gone.
+        shutil.rmtree(join(self.root, 'b'))
+        discover_workspaces(join(self.root, 'b'))
+        self.assertNotIn(join(self.root, 'b', 'c'), core._workspace_markers)
+        self.assertIn(join(self.root, 'a'), core._workspace_markers)
+
+        forget_workspaces(join(self.root, 'a'))
+        self.assertNotIn(join(self.root, 'a'), core._workspace_markers)
+        forget_workspaces()
+        self.assertEqual(core._workspace_markers, {})
+
+    def test_discover_no_cache(self):
+        discover_workspaces(self.root, cache=False)
+        self.assertEqual(core._workspace_markers, {})
+        # probed instead.
+        workspace = CmdWorkspace(join(self.root, 'd'), auto=True)
+        self.assertTrue(isinstance(workspace.cmd, FirstCmd))
@@ -3,6 +3,7 @@ from unittest import TestCase
 import os
 from os.path import join
 import tempfile
+import time
 import shutil
 
 from pmr2.wfctrl.core import CmdWorkspace
@@ -57,6 +58,129 @@ class DemoVcsCmdWorkspaceTestCase(CoreTestCase, CoreTests):
             ['vcs', 'push'],
         ])
 
+    def _age(self, *filenames):
+        # move the modification times out of the racy window.
+        mtime_ns = (int(time.time()) - 60) * 10 ** 9
+        for filename in filenames:
+            os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+    def test_cmd_save_unchanged(self):
+        wks = self.make_workspace()
+        fn1, fn2, fn3 = self.add_files_multi(wks)
+        self._age(fn1, fn2, fn3)
+        wks.save()
+        self.assertEqual(len(self.cmd.queue), 5)
+        self.assertTrue(os.path.exists(join(
+            self.workspace_dir, self.wks_marker, wks.stat_cache_name)))
+
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'push'],
+        ])
+
+        # modified, and a new instance which uses the persisted cache.
+        self.write_file('Modified content', fn2)
+        wks = CmdWorkspace(self.workspace_dir, self.cmd)
+        for filename in (fn1, fn2, fn3):
+            wks.add_file(filename)
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'add', fn2],
+            ['vcs', 'commit', '-m', ''],
+            ['vcs', 'push'],
+        ])
+
+    def test_cmd_save_removed(self):
+        wks = self.make_workspace()
+        fn1, fn2, fn3 = self.add_files_multi(wks)
+        self._age(fn1, fn2, fn3)
+        wks.save()
+        os.remove(fn2)
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'add', fn2],
+            ['vcs', 'commit', '-m', ''],
+            ['vcs', 'push'],
+        ])
+
+        # the saved removal is not staged again, including by a new
+        # instance which uses the persisted cache.
+        wks = CmdWorkspace(self.workspace_dir, self.cmd)
+        for filename in (fn1, fn2, fn3):
+            wks.add_file(filename)
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'push'],
+        ])
+
+        # until it is restored.
+        self.write_file('Restored content', fn2)
+        self._age(fn2)
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue[0], ['vcs', 'add', fn2])
+
+    def test_cmd_save_racy(self):
+        wks = self.make_workspace()
+        filename = self.add_files_simple(wks)
+        wks.save()
+        self.cmd.queue[:] = []
+        # recently modified files are staged again.
+        wks.save()
+        self.assertEqual(self.cmd.queue[0], ['vcs', 'add', filename])
+
+    def test_cmd_save_add_failed(self):
+        wks = self.make_workspace()
+        fn1, fn2, fn3 = self.add_files_multi(wks)
+        self._age(fn1, fn2, fn3)
+        add = self.cmd.add
+
+        def failing_add(workspace, path, **kw):
+            add(workspace, path, **kw)
+            if path == fn2:
+                return b'', b'failed', 1
+
+        self.cmd.add = failing_add
+        wks.save()
+        del self.cmd.add
+        # the files are staged again, as the add may not have staged any.
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'add', fn1],
+            ['vcs', 'add', fn2],
+            ['vcs', 'add', fn3],
+            ['vcs', 'commit', '-m', ''],
+            ['vcs', 'push'],
+        ])
+
+    def test_cmd_save_hash_files(self):
+        self.cmd = DemoDvcsCmd()
+        os.mkdir(join(self.workspace_dir, self.wks_marker))
+        wks = CmdWorkspace(self.workspace_dir, self.cmd, hash_files=True)
+        filename = self.add_files_simple(wks)
+        self._age(filename)
+        wks.save()
+
+        # touched only.
+        os.utime(filename, ns=(
+            (int(time.time()) - 30) * 10 ** 9,
+            (int(time.time()) - 30) * 10 ** 9))
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue, [
+            ['vcs', 'push'],
+        ])
+
+        wks.clear_stat_cache()
+        self.cmd.queue[:] = []
+        wks.save()
+        self.assertEqual(self.cmd.queue[0], ['vcs', 'add', filename])
+
     def test_cmd_pull(self):
         wks = self.make_workspace()
         # TODO make a remote sync workflow of sort